@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "rides.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -137,8 +138,99 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.OrderingFilter',
     ],
+    # Clients opt into MessagePack with `Accept: application/msgpack`
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rides.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rides.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'rides.throttling.TokenBucketThrottle',
+    ],
+}
+
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Rate limit buckets must be shared by every worker process, so they are
+    # kept on disk rather than in per-process memory. There is one entry per
+    # active client. Once MAX_ENTRIES is exceeded, entries are culled and
+    # those clients start over with a full bucket, so keep it well above the
+    # number of clients active within a bucket's refill time. Every write
+    # also lists the cache directory, an O(clients) cost per request. With
+    # many clients, or more than one host, use Redis instead
+    # (django.core.cache.backends.redis.RedisCache), which neither culls nor
+    # scans.
+    "throttle": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache" / "throttle",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+}
+
+# Rate limiting (rides.throttling.TokenBucketThrottle)
+RATE_LIMITS = {
+    'CACHE': 'throttle',
+    # Token bucket per client: up to `capacity` tokens, refilled at
+    # `refill_rate` tokens per second
+    'ROLES': {
+        'admin': {'capacity': 600, 'refill_rate': 10},
+        'driver': {'capacity': 300, 'refill_rate': 5},
+        'rider': {'capacity': 120, 'refill_rate': 2},
+        'anon': {'capacity': 60, 'refill_rate': 1},
+    },
+    # Tokens consumed per request; everything but `default` is added on top
+    'COSTS': {
+        'default': 1,
+        'distance_ordering': 10,
+        'search': 5,
+        'clusters': 5,
+        'write': 2,
+        'bulk_import': 100,
+    },
+    # Fraction of each bucket that only cheap requests may use
+    'RESERVE': 0.2,
+}
+
+# Most users accepted by one /api/users/bulk-import/ request; larger imports
+# go through `python manage.py import_users`
+BULK_IMPORT_MAX_ROWS = 1000
+
+# Batched API requests (rides.views.BatchView)
+BATCH_REQUESTS = {
+    'MAX_REQUESTS': 20,
+    # Threads used to run independent read-only sub-requests concurrently
+    'MAX_WORKERS': 4,
+}
+
+# Request profiling (rides.profiling.ProfilingMixin)
+PROFILING = {
+    'DIRECTORY': BASE_DIR / '.profiles',
+    # Fraction of all requests profiled automatically, e.g. 0.001 for 1 in 1000
+    'SAMPLE_RATE': 0.0,
+    # Older profiles are deleted once the directory holds this many
+    'MAX_PROFILES': 200,
 }
 
+# Response compression (rides.middleware.CompressionMiddleware)
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 5
+
+# Completed and cancelled rides with a pickup_time older than this are moved
+# to the archive tables by `python manage.py archive_rides`
+RIDE_ARCHIVE_RETENTION_DAYS = 90
+
 # JWT settings
 from datetime import timedelta
 
@@ -18,16 +18,19 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from rides.views import RideViewSet, UserViewSet
+from rides.views import RideViewSet, UserViewSet, ChangeFeedViewSet, ProfileViewSet, BatchView
 
 # Create a router and register our viewsets
 router = DefaultRouter()
 router.register(r'rides', RideViewSet, basename='ride')
 router.register(r'users', UserViewSet, basename='user')
+router.register(r'changes', ChangeFeedViewSet, basename='change')
+router.register(r'profiles', ProfileViewSet, basename='profile')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
+    path('api/batch/', BatchView.as_view(), name='batch'),
     path('api-auth/', include('rest_framework.urls')),
     # JWT Authentication endpoints
     path('api/auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
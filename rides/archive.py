@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedRide, ArchivedRideEvent, ArchiveRun, ChangeLogEntry, Ride, RideEvent
+from .signals import archiving
+
+ARCHIVED_STATUSES = ('completed', 'cancelled')
+
+RIDE_FIELDS = [
+    'id_ride', 'status', 'rider_id', 'driver_id', 'pickup_latitude', 'pickup_longitude',
+    'dropoff_latitude', 'dropoff_longitude', 'pickup_time',
+]
+EVENT_FIELDS = ['id_ride_event', 'ride_id', 'description', 'created_at']
+
+
+def archive_cutoff(retention_days=None):
+    """
+    Returns the pickup_time before which completed and cancelled rides
+    belong in the archive.
+    """
+    if retention_days is None:
+        retention_days = settings.RIDE_ARCHIVE_RETENTION_DAYS
+    return timezone.now() - timedelta(days=retention_days)
+
+
+def archive_watermark():
+    """
+    Returns the cutoff of the latest archive_rides run that moved every
+    archivable ride, or None if no run has finished yet. Completed and
+    cancelled rides with an older pickup_time are all in the archive.
+    """
+    return ArchiveRun.objects.order_by('-cutoff').values_list('cutoff', flat=True).first()
+
+
+def archivable_rides(cutoff):
+    return Ride.objects.filter(status__in=ARCHIVED_STATUSES, pickup_time__lt=cutoff)
+
+
+def archive_batch(cutoff, batch_size):
+    """
+    Moves up to batch_size archivable rides and their events from the hot
+    tables into the archive in a single transaction.
+
+    Each batch either fully commits or leaves nothing behind, so an
+    interrupted run can simply be started again and continues where the
+    last committed batch stopped.
+
+    The change log gets one 'archive' entry per ride instead of deletes,
+    so delta sync clients don't drop rides that are still readable with
+    ?archived=true.
+
+    Returns the number of rides archived (0 when there is nothing left).
+    """
+    with transaction.atomic():
+        ride_ids = list(
+            archivable_rides(cutoff).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ride_ids:
+            return 0
+
+        ArchivedRide.objects.bulk_create([
+            ArchivedRide(**values)
+            for values in Ride.objects.filter(pk__in=ride_ids).values(*RIDE_FIELDS)
+        ])
+        ArchivedRideEvent.objects.bulk_create([
+            ArchivedRideEvent(**values)
+            for values in RideEvent.objects.filter(ride_id__in=ride_ids).values(*EVENT_FIELDS)
+        ], batch_size=batch_size)
+
+        with archiving():
+            RideEvent.objects.filter(ride_id__in=ride_ids).delete()
+            Ride.objects.filter(pk__in=ride_ids).delete()
+        ChangeLogEntry.objects.bulk_create([
+            ChangeLogEntry(model='ride', object_id=ride_id, action='archive')
+            for ride_id in ride_ids
+        ])
+    return len(ride_ids)
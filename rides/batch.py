@@ -0,0 +1,122 @@
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+ALLOWED_METHODS = SAFE_METHODS + ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# Headers copied from the batch request onto every sub-request
+FORWARDED_META = (
+    'REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT', 'HTTP_HOST', 'HTTP_ACCEPT_LANGUAGE', 'HTTP_USER_AGENT',
+    'wsgi.url_scheme',
+)
+
+
+def build_subrequest(request, method, path, body):
+    """
+    Builds a Django request for one entry of the batch, carrying the batch
+    request's already authenticated user so sub-requests don't repeat
+    JWT or session authentication.
+    """
+    url = urlsplit(path)
+    data = json.dumps(body).encode() if body is not None else b''
+
+    subrequest = HttpRequest()
+    subrequest.method = method
+    subrequest.path = subrequest.path_info = url.path
+    subrequest.GET = QueryDict(url.query)
+    subrequest.META = {key: request.META[key] for key in FORWARDED_META if key in request.META}
+    subrequest.META.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'HTTP_ACCEPT': 'application/json',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(data)),
+    })
+    subrequest._stream = io.BytesIO(data)
+    subrequest._read_started = False
+    # Picked up by rest_framework.request.Request in place of the configured authenticators
+    subrequest._force_auth_user = request.user
+    subrequest._force_auth_token = request.auth
+    return subrequest
+
+
+def run_subrequest(request, spec, batch_view):
+    """
+    Resolves and runs one sub-request against the project's URLconf,
+    returning its status code and response data. An unhandled exception
+    in the view becomes a 500 for that entry only, so the rest of the
+    batch is still returned.
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get('path'), str):
+        return {'status': 400, 'body': {'detail': 'Each request needs a "path".'}}
+
+    method = str(spec.get('method', 'GET')).upper()
+    if method not in ALLOWED_METHODS:
+        return {'status': 405, 'body': {'detail': f'Method "{method}" not allowed.'}}
+
+    path = spec['path']
+    if not path.startswith('/'):
+        path = '/api/' + path
+    if not path.startswith('/api/'):
+        return {'status': 400, 'body': {'detail': 'Only /api/ endpoints can be batched.'}}
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return {'status': 404, 'body': {'detail': 'Not found.'}}
+    if getattr(match.func, 'view_class', None) is batch_view:
+        return {'status': 400, 'body': {'detail': 'Batch requests cannot be nested.'}}
+
+    subrequest = build_subrequest(request, method, path, spec.get('body'))
+    try:
+        response = match.func(subrequest, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception('Batched request %s %s failed', method, path)
+        return {'status': 500, 'body': {'detail': 'A server error occurred.'}}
+    return {'status': response.status_code, 'body': getattr(response, 'data', None)}
+
+
+def run_batch(request, specs, batch_view):
+    """
+    Runs the sub-requests and returns their results in request order.
+
+    Consecutive read-only sub-requests are independent of each other and run
+    concurrently on BATCH_REQUESTS['MAX_WORKERS'] threads, each thread using
+    its own database connection. Writes run one at a time on the batch
+    request's connection and act as barriers, so a read listed after a write
+    sees its effect. Everything runs sequentially inside a transaction,
+    because other connections can't see its uncommitted data.
+    """
+    max_workers = settings.BATCH_REQUESTS['MAX_WORKERS']
+    if connection.in_atomic_block:
+        max_workers = 1
+
+    def run_threaded(spec):
+        try:
+            return run_subrequest(request, spec, batch_view)
+        finally:
+            connection.close()
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending_reads = []
+        for spec in specs:
+            method = str(spec.get('method', 'GET')).upper() if isinstance(spec, dict) else 'GET'
+            if max_workers > 1 and method in SAFE_METHODS:
+                pending_reads.append(executor.submit(run_threaded, spec))
+                continue
+            results.extend(future.result() for future in pending_reads)
+            pending_reads = []
+            results.append(run_subrequest(request, spec, batch_view))
+        results.extend(future.result() for future in pending_reads)
+    return results
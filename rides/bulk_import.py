@@ -0,0 +1,145 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from rest_framework.validators import UniqueValidator
+
+from .serializers import UserSerializer
+
+User = get_user_model()
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Below this many passwords the cost of starting worker processes outweighs
+# the hashing work, so hashing stays in the calling process.
+MIN_PARALLEL_PASSWORDS = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class BulkImportError(Exception):
+    """
+    Raised when an import batch contains invalid rows.
+    `errors` maps the row index to a dict of field errors.
+    """
+    def __init__(self, errors):
+        super().__init__('Invalid rows in bulk user import')
+        self.errors = errors
+
+
+class BulkUserSerializer(UserSerializer):
+    """
+    UserSerializer without the per-row username uniqueness query;
+    validate_rows checks every row's username with a single query instead.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        fields['username'].validators = [
+            validator for validator in fields['username'].validators
+            if not isinstance(validator, UniqueValidator)
+        ]
+        return fields
+
+
+def hashing_pool():
+    """
+    Returns the process pool shared by every import in this process.
+    It is started on first use, so web workers that never import users
+    don't fork, and later requests reuse the same worker processes.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _pool
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hashes a list of raw passwords, preserving order.
+
+    PBKDF2 is CPU-bound and holds the GIL, so the work is spread across a
+    process pool rather than threads. Throughput scales with the number of
+    worker processes. By default the shared hashing_pool() with one worker
+    per CPU core is used; passing `workers` runs a dedicated pool of that
+    size for the duration of the call.
+    """
+    if len(passwords) < MIN_PARALLEL_PASSWORDS or workers == 1:
+        return [make_password(password) for password in passwords]
+
+    chunksize = max(1, len(passwords) // ((workers or os.cpu_count() or 1) * 4))
+    if workers is None:
+        return list(hashing_pool().map(make_password, passwords, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(make_password, passwords, chunksize=chunksize))
+
+
+def validate_rows(rows):
+    """
+    Validates every row with the same rules as the user create endpoint
+    and returns the validated data. Username uniqueness is checked against
+    the database with a single query per batch of usernames instead of one
+    query per row.
+    """
+    serializer = BulkUserSerializer(data=rows, many=True)
+    serializer.is_valid()
+    errors = {index: row_errors for index, row_errors in enumerate(serializer.errors) if row_errors}
+
+    seen = {}
+    for index, row in enumerate(rows):
+        username = row.get('username')
+        if index in errors or not isinstance(username, str):
+            continue
+        if username in seen:
+            errors[index] = {'username': [f'Duplicate of row {seen[username]}.']}
+        else:
+            seen[username] = index
+
+    usernames = list(seen)
+    existing = set()
+    for start in range(0, len(usernames), DEFAULT_BATCH_SIZE):
+        existing.update(
+            User.objects.filter(username__in=usernames[start:start + DEFAULT_BATCH_SIZE])
+            .values_list('username', flat=True)
+        )
+    for username in existing:
+        errors[seen[username]] = {'username': ['A user with that username already exists.']}
+
+    if errors:
+        raise BulkImportError(dict(sorted(errors.items())))
+    return serializer.validated_data
+
+
+def bulk_import_users(rows, batch_size=DEFAULT_BATCH_SIZE, workers=None):
+    """
+    Creates users from a list of dicts with the same fields accepted by
+    UserSerializer. All rows are validated before anything is written, then
+    passwords are hashed in parallel and users are inserted with bulk_create
+    in batches inside a single transaction.
+
+    Returns the number of users created.
+    """
+    rows = validate_rows(rows)
+    hashed = hash_passwords([row['password'] for row in rows], workers=workers)
+
+    users = [
+        User(
+            username=row['username'],
+            email=row.get('email', ''),
+            password=password,
+            first_name=row.get('first_name', ''),
+            last_name=row.get('last_name', ''),
+            role=row.get('role', 'rider'),
+            phone_number=row.get('phone_number', ''),
+            is_active=True,
+        )
+        for row, password in zip(rows, hashed)
+    ]
+
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=batch_size)
+    return len(users)
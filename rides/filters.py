@@ -0,0 +1,63 @@
+import django_filters
+from django import forms
+from django.db.models import Q
+
+from .models import ArchivedRide, Ride
+
+
+class BBoxField(forms.CharField):
+    """
+    Parses "min_lon,min_lat,max_lon,max_lat" (GeoJSON order) into a tuple of floats.
+    """
+    def clean(self, value):
+        value = super().clean(value)
+        if not value:
+            return None
+        try:
+            bbox = tuple(float(part) for part in value.split(','))
+        except ValueError:
+            raise forms.ValidationError('bbox must be four comma-separated numbers.')
+        if len(bbox) != 4:
+            raise forms.ValidationError('bbox must be min_lon,min_lat,max_lon,max_lat.')
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+            raise forms.ValidationError('bbox is outside valid latitude/longitude ranges.')
+        return bbox
+
+
+class BBoxFilter(django_filters.Filter):
+    """
+    Keeps rides whose pickup point lies inside the bounding box.
+    A box with min_lon greater than max_lon crosses the antimeridian.
+    """
+    field_class = BBoxField
+
+    def filter(self, qs, value):
+        if value is None:
+            return qs
+        min_lon, min_lat, max_lon, max_lat = value
+        qs = qs.filter(pickup_latitude__gte=min_lat, pickup_latitude__lte=max_lat)
+        if min_lon <= max_lon:
+            return qs.filter(pickup_longitude__gte=min_lon, pickup_longitude__lte=max_lon)
+        return qs.filter(Q(pickup_longitude__gte=min_lon) | Q(pickup_longitude__lte=max_lon))
+
+
+class RideFilter(django_filters.FilterSet):
+    """
+    Filters for the rides list.
+    pickup_time_after / pickup_time_before take ISO 8601 datetimes and
+    select a half-open [after, before) range. bbox limits pickups to the
+    visible map viewport.
+    """
+    pickup_time_after = django_filters.IsoDateTimeFilter(field_name='pickup_time', lookup_expr='gte')
+    pickup_time_before = django_filters.IsoDateTimeFilter(field_name='pickup_time', lookup_expr='lt')
+    bbox = BBoxFilter()
+
+    class Meta:
+        model = Ride
+        fields = ['status', 'rider__email']
+
+
+class ArchivedRideFilter(RideFilter):
+    class Meta(RideFilter.Meta):
+        model = ArchivedRide
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rides.archive import archivable_rides, archive_batch, archive_cutoff
+from rides.models import ArchiveRun
+
+
+class Command(BaseCommand):
+    help = 'Moves completed and cancelled rides older than the retention window into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.RIDE_ARCHIVE_RETENTION_DAYS,
+                            help='Retention window in days (rides with an older pickup_time are archived)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rides moved per transaction')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop after this many batches; run again to resume')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many rides would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+
+        if options['dry_run']:
+            count = archivable_rides(cutoff).count()
+            self.stdout.write(f'{count} rides with pickup_time before {cutoff:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        total = 0
+        batches = 0
+        finished = False
+        while options['max_batches'] is None or batches < options['max_batches']:
+            archived = archive_batch(cutoff, options['batch_size'])
+            if not archived:
+                finished = True
+                break
+            total += archived
+            batches += 1
+            self.stdout.write(f'Batch {batches}: archived {archived} rides ({total} total)')
+
+        if finished:
+            # Everything before the cutoff is archived, so the rides list can
+            # serve older date ranges from the archive alone
+            ArchiveRun.objects.create(cutoff=cutoff)
+            self.stdout.write(self.style.SUCCESS(f'Successfully archived {total} rides'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Archived {total} rides; stopped after {batches} batches, run again to continue'
+            ))
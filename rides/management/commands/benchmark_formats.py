@@ -0,0 +1,96 @@
+import gzip
+import io
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from rides.middleware import brotli
+from rides.models import Ride, RideEvent, User
+from rides.renderers import MessagePackParser, MessagePackRenderer
+from rides.serializers import RideSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares payload size and encode/decode time of JSON and MessagePack ride list responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=100, help='Number of rides in the payload')
+        parser.add_argument('--events', type=int, default=3, help="Number of today's events per ride")
+        parser.add_argument('--repeat', type=int, default=50, help='Number of timing iterations')
+
+    def build_payload(self, ride_count, event_count):
+        """
+        Serializes unsaved rides with the real RideSerializer, so the payload
+        has exactly the shape of a /api/rides/ page without touching the database.
+        """
+        now = timezone.now()
+        rider = User(id=1, username='rider', email='rider@example.com', first_name='John',
+                     last_name='Doe', role='rider', phone_number='+1234567890')
+        driver = User(id=2, username='driver', email='driver@example.com', first_name='Jane',
+                      last_name='Smith', role='driver', phone_number='+0987654321')
+        rides = []
+        for i in range(ride_count):
+            ride = Ride(id_ride=i + 1, status='en-route', rider=rider, driver=driver,
+                        pickup_latitude=37.7749 + i / 1000, pickup_longitude=-122.4194,
+                        dropoff_latitude=37.7833, dropoff_longitude=-122.4167,
+                        pickup_time=now - timedelta(minutes=i))
+            ride.todays_ride_events = [
+                RideEvent(id_ride_event=i * event_count + j, ride=ride,
+                          description='Status changed to en-route', created_at=now)
+                for j in range(event_count)
+            ]
+            rides.append(ride)
+        return {
+            'count': ride_count,
+            'next': None,
+            'previous': None,
+            'results': RideSerializer(rides, many=True).data,
+        }
+
+    def time_it(self, func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return result, (time.perf_counter() - started) / repeat * 1000
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        payload = self.build_payload(options['rides'], options['events'])
+
+        json_renderer = JSONRenderer()
+        msgpack_renderer = MessagePackRenderer()
+        msgpack_parser = MessagePackParser()
+
+        codecs = [
+            ('json', lambda: json_renderer.render(payload), lambda body: json.loads(body)),
+            ('msgpack', lambda: msgpack_renderer.render(payload),
+             lambda body: msgpack_parser.parse(io.BytesIO(body))),
+        ]
+
+        self.stdout.write(f'{"format":<16}{"bytes":>10}{"vs json":>10}{"encode ms":>12}{"decode ms":>12}')
+        json_size = None
+        for name, encode, decode in codecs:
+            body, encode_ms = self.time_it(encode, repeat)
+            _, decode_ms = self.time_it(lambda: decode(body), repeat)
+            json_size = json_size or len(body)
+            self.write_row(name, len(body), json_size, encode_ms, decode_ms)
+
+            compressors = [('gzip', lambda data: gzip.compress(data, compresslevel=6), gzip.decompress)]
+            if brotli is not None:
+                compressors.append(('br', lambda data: brotli.compress(data, quality=settings.COMPRESSION_BROTLI_QUALITY), brotli.decompress))
+            for suffix, compress, decompress in compressors:
+                compressed, compress_ms = self.time_it(lambda: compress(body), repeat)
+                _, decompress_ms = self.time_it(lambda: decode(decompress(compressed)), repeat)
+                self.write_row(f'{name}+{suffix}', len(compressed), json_size,
+                               encode_ms + compress_ms, decompress_ms)
+
+    def write_row(self, name, size, json_size, encode_ms, decode_ms):
+        self.stdout.write(
+            f'{name:<16}{size:>10}{size / json_size:>9.0%} {encode_ms:>12.3f}{decode_ms:>12.3f}'
+        )
+
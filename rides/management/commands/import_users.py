@@ -0,0 +1,49 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.bulk_import import DEFAULT_BATCH_SIZE, BulkImportError, bulk_import_users
+
+
+class Command(BaseCommand):
+    help = 'Bulk imports users from a CSV or JSON file, hashing passwords across a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row, or a JSON list of user objects')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Number of users per INSERT statement')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of hashing processes (defaults to the CPU count)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, newline='', encoding='utf-8') as f:
+                if path.endswith('.json'):
+                    rows = json.load(f)
+                else:
+                    # An empty CSV cell means the column wasn't given for that row
+                    rows = [
+                        {key: value for key, value in row.items() if value != ''}
+                        for row in csv.DictReader(f)
+                    ]
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise CommandError(f'{path} must contain a list of user objects')
+
+        started = time.perf_counter()
+        try:
+            created = bulk_import_users(rows, batch_size=options['batch_size'], workers=options['workers'])
+        except BulkImportError as e:
+            for index, errors in e.errors.items():
+                self.stdout.write(self.style.ERROR(f'Row {index}: {errors}'))
+            raise CommandError(f'{len(e.errors)} invalid rows, nothing was imported')
+        elapsed = time.perf_counter() - started
+
+        rate = created / elapsed if elapsed else created
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully imported {created} users in {elapsed:.2f}s ({rate:.0f} rows/s)'
+        ))
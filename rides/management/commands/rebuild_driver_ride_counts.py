@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from rides.models import DriverRideCount, Ride
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-driver ride counts used by the driver ride history endpoint'
+
+    def handle(self, *args, **options):
+        rows = (
+            Ride.objects.filter(driver__isnull=False)
+            .values('driver_id', 'status')
+            .annotate(count=Count('pk'))
+            .order_by()
+        )
+        with transaction.atomic():
+            DriverRideCount.objects.all().delete()
+            DriverRideCount.objects.bulk_create([DriverRideCount(**row) for row in rows], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully rebuilt ride counts ({DriverRideCount.objects.count()} driver/status pairs)'
+        ))
@@ -0,0 +1,145 @@
+import secrets
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+def accepted_encodings(accept_encoding):
+    """
+    Returns the content codings in an Accept-Encoding header that
+    aren't explicitly refused with q=0.
+    """
+    encodings = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            encodings.add(coding)
+    return encodings
+
+
+def brotli_padding(max_random_bytes):
+    """
+    Returns a brotli metadata meta-block holding 1 to max_random_bytes
+    (at most 256) random bytes. Decoders skip metadata, so inserting it at a
+    byte boundary varies the compressed length without changing the content,
+    the BREACH mitigation the gzip path gets from a random file name.
+    """
+    length = 1 + secrets.randbelow(max_random_bytes)
+    # ISLAST=0, MNIBBLES=0 (metadata), MSKIPBYTES=1, then MSKIPLEN-1 in one byte
+    header = 0b010110 | (length - 1) << 6
+    return header.to_bytes(2, 'little') + secrets.token_bytes(length)
+
+
+def brotli_compress(content, *, max_random_bytes=None):
+    compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+    # flush() ends the stream header on a byte boundary, where padding can go
+    data = compressor.flush()
+    if max_random_bytes:
+        data += brotli_padding(max_random_bytes)
+    return data + compressor.process(content) + compressor.finish()
+
+
+def brotli_compress_sequence(sequence, *, max_random_bytes=None):
+    compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+    data = compressor.flush()
+    if max_random_bytes:
+        data += brotli_padding(max_random_bytes)
+    yield data
+    for item in sequence:
+        # Flush every chunk so the client receives it without waiting for the rest
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with brotli or gzip, whichever the client accepts
+    (brotli is preferred when installed).
+
+    Regular responses are only compressed when they are at least
+    COMPRESSION_MIN_SIZE bytes, since small payloads gain little and still
+    pay the CPU cost. Streaming responses are compressed chunk by chunk as
+    they are sent, so large ride exports never have to be buffered in memory.
+    Both encodings add up to max_random_bytes of random padding to mitigate
+    BREACH, like Django's GZipMiddleware.
+    """
+    max_random_bytes = 100
+
+    def select_encoding(self, request):
+        encodings = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in encodings:
+            return 'br'
+        if 'gzip' in encodings:
+            return 'gzip'
+        return None
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        # Async streaming responses and already encoded content are passed through
+        if response.has_header('Content-Encoding') or getattr(response, 'is_async', False):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = self.select_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if encoding == 'br':
+                response.streaming_content = brotli_compress_sequence(
+                    response.streaming_content,
+                    max_random_bytes=self.max_random_bytes,
+                )
+            else:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content,
+                    max_random_bytes=self.max_random_bytes,
+                )
+            # The compressed size isn't known until the stream is finished
+            del response.headers['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed_content = brotli_compress(
+                    response.content,
+                    max_random_bytes=self.max_random_bytes,
+                )
+            else:
+                compressed_content = compress_string(
+                    response.content,
+                    max_random_bytes=self.max_random_bytes,
+                )
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # Compressed bytes differ from the original, so a strong ETag must become weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+
+        return response
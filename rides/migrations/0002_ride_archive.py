@@ -0,0 +1,58 @@
+# Generated by Django 5.0.2 on 2026-10-19 09:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRide',
+            fields=[
+                ('id_ride', models.IntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('en-route', 'En-Route'), ('pickup', 'Pickup'), ('dropoff', 'Dropoff'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('pickup_latitude', models.FloatField()),
+                ('pickup_longitude', models.FloatField()),
+                ('dropoff_latitude', models.FloatField()),
+                ('dropoff_longitude', models.FloatField()),
+                ('pickup_time', models.DateTimeField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedRideEvent',
+            fields=[
+                ('id_ride_event', models.IntegerField(primary_key=True, serialize=False)),
+                ('description', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['status', 'pickup_time'], name='ride_status_pickup_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedride',
+            name='driver',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_rides_as_driver', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedride',
+            name='rider',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_rides_as_rider', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedrideevent',
+            name='ride',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='rides.archivedride'),
+        ),
+    ]
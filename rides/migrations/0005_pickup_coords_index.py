@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-19 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0004_change_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['pickup_latitude', 'pickup_longitude'], name='ride_pickup_coords_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.2 on 2026-10-19 09:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_driver_ride_counts(apps, schema_editor):
+    """
+    Counts the rides that already exist, like rebuild_driver_ride_counts,
+    so the signal handlers start adjusting correct totals.
+    """
+    Ride = apps.get_model('rides', 'Ride')
+    DriverRideCount = apps.get_model('rides', 'DriverRideCount')
+    rows = (
+        Ride.objects.filter(driver__isnull=False)
+        .values('driver_id', 'status')
+        .annotate(count=Count('pk'))
+        .order_by()
+    )
+    DriverRideCount.objects.bulk_create([DriverRideCount(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0005_pickup_coords_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverRideCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('en-route', 'En-Route'), ('pickup', 'Pickup'), ('dropoff', 'Dropoff'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['driver', 'pickup_time'], name='ride_driver_pickup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['driver', 'status', 'pickup_time'], name='ride_driver_status_pickup_idx'),
+        ),
+        migrations.AddField(
+            model_name='driverridecount',
+            name='driver',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ride_counts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='driverridecount',
+            constraint=models.UniqueConstraint(fields=('driver', 'status'), name='unique_driver_ride_count'),
+        ),
+        migrations.RunPython(fill_driver_ride_counts, migrations.RunPython.noop),
+    ]
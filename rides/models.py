@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 
 class User(AbstractUser):
 
@@ -14,6 +15,12 @@ class User(AbstractUser):
     def __str__(self):
         return self.email
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Serves the rider__email filter on the rides list
+            models.Index(fields=['email'], name='user_email_idx'),
+        ]
+
 
 class Ride(models.Model):
     STATUS_CHOICES = (
@@ -36,9 +43,12 @@ class Ride(models.Model):
     pickup_time = models.DateTimeField()
 
     def save(self, *args, **kwargs):
+        # (driver_id, status) before this save, used to keep DriverRideCount in sync
+        self._previous_state = None
         if self.pk:
             old_ride = Ride.objects.get(pk=self.pk)
             old_status = old_ride.status
+            self._previous_state = (old_ride.driver_id, old_status)
             
             if self.status != old_status:
                 if self.status == 'pickup':
@@ -57,6 +67,19 @@ class Ride(models.Model):
     def __str__(self):
         return f"Ride {self.id_ride} ({self.status})"
 
+    class Meta:
+        indexes = [
+            # Serves status filters ordered by pickup_time and the archival scan
+            models.Index(fields=['status', 'pickup_time'], name='ride_status_pickup_idx'),
+            # Serves the default -pickup_time ordering without a sort step
+            models.Index(fields=['pickup_time'], name='ride_pickup_time_idx'),
+            # Serves the map viewport (bbox) filter and pickup clustering
+            models.Index(fields=['pickup_latitude', 'pickup_longitude'], name='ride_pickup_coords_idx'),
+            # Serve a driver's ride history newest first, with and without a status filter
+            models.Index(fields=['driver', 'pickup_time'], name='ride_driver_pickup_idx'),
+            models.Index(fields=['driver', 'status', 'pickup_time'], name='ride_driver_status_pickup_idx'),
+        ]
+
 class RideEvent(models.Model):
     id_ride_event = models.AutoField(primary_key=True)
     ride = models.ForeignKey(Ride, related_name='events', on_delete=models.CASCADE)
@@ -67,4 +90,100 @@ class RideEvent(models.Model):
         return f"Event {self.id_ride_event} for Ride {self.ride.id_ride}"
 
     class Meta:
-        ordering = ['created_at']
\ No newline at end of file
+        ordering = ['created_at']
+
+
+class DriverRideCount(models.Model):
+    """
+    Number of rides in the Ride table per driver and status, kept up to date
+    by the signal handlers in rides.signals so driver ride history pages
+    don't need a COUNT(*). Rebuild with `python manage.py rebuild_driver_ride_counts`.
+    """
+    driver = models.ForeignKey(User, related_name='ride_counts', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=Ride.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.driver_id} {self.status}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['driver', 'status'], name='unique_driver_ride_count'),
+        ]
+
+class ArchivedRide(models.Model):
+    """
+    Cold storage for completed and cancelled rides older than the retention
+    window. Rows are moved here from Ride by the archive_rides command and
+    keep their original id_ride, so links to a ride stay valid.
+    """
+    id_ride = models.IntegerField(primary_key=True)
+    status = models.CharField(max_length=20, choices=Ride.STATUS_CHOICES)
+    rider = models.ForeignKey(User, related_name='archived_rides_as_rider', on_delete=models.SET_NULL, null=True, blank=True)
+    driver = models.ForeignKey(User, related_name='archived_rides_as_driver', on_delete=models.SET_NULL, null=True, blank=True)
+    pickup_latitude = models.FloatField()
+    pickup_longitude = models.FloatField()
+    dropoff_latitude = models.FloatField()
+    dropoff_longitude = models.FloatField()
+    pickup_time = models.DateTimeField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived ride {self.id_ride} ({self.status})"
+
+class ArchivedRideEvent(models.Model):
+    id_ride_event = models.IntegerField(primary_key=True)
+    ride = models.ForeignKey(ArchivedRide, related_name='events', on_delete=models.CASCADE)
+    description = models.CharField(max_length=255)
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Archived event {self.id_ride_event} for Ride {self.ride_id}"
+
+    class Meta:
+        ordering = ['created_at']
+
+class ArchiveRun(models.Model):
+    """
+    A run of the archive_rides command that finished with nothing left to
+    move, i.e. every completed and cancelled ride with a pickup_time before
+    `cutoff` was in the archive at `finished_at`. The latest cutoff is the
+    watermark below which the rides list may read from the archive alone.
+    """
+    cutoff = models.DateTimeField(db_index=True)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive run up to {self.cutoff:%Y-%m-%d %H:%M}"
+
+
+class ChangeLogEntry(models.Model):
+    """
+    One create, update, delete or archival of a Ride or RideEvent, numbered
+    by a monotonically increasing sequence. Written by the signal handlers in
+    rides.signals and rides.archive, and served by the /api/changes/ feed.
+    """
+    ACTION_CHOICES = (
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+        # Moved to the archive tables; still readable with ?archived=true
+        ('archive', 'Archive'),
+    )
+    MODEL_CHOICES = (
+        ('ride', 'Ride'),
+        ('ride_event', 'Ride event'),
+    )
+    seq = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    # Column values after the change; null for deletes and archivals
+    data = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Change {self.seq}: {self.action} {self.model} {self.object_id}"
+
+    class Meta:
+        ordering = ['seq']
@@ -0,0 +1,199 @@
+import cProfile
+import io
+import json
+import pstats
+import random
+import re
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def profile_dir():
+    return Path(settings.PROFILING['DIRECTORY'])
+
+
+def profile_path(request_id, suffix):
+    if not REQUEST_ID_RE.match(request_id):
+        raise ValueError(f'Invalid request id: {request_id!r}')
+    return profile_dir() / f'{request_id}{suffix}'
+
+
+def prune_profiles(keep):
+    """
+    Deletes all but the `keep` most recently written profiles.
+    """
+    metadata_files = sorted(profile_dir().glob('*.json'), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in metadata_files[keep:]:
+        path.with_suffix('.prof').unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
+
+
+def list_profiles():
+    """
+    Returns the metadata of every captured profile, newest first.
+    The SQL trace is left out to keep the listing small.
+    """
+    directory = profile_dir()
+    if not directory.exists():
+        return []
+    profiles = []
+    for path in directory.glob('*.json'):
+        with open(path) as f:
+            data = json.load(f)
+        data.pop('queries', None)
+        profiles.append(data)
+    return sorted(profiles, key=lambda data: data['created_at'], reverse=True)
+
+
+def load_profile(request_id, limit=30):
+    """
+    Returns the metadata and SQL trace of a profile plus a text summary of
+    its `limit` most expensive functions by cumulative time, or None if
+    there is no profile for the request id.
+    """
+    path = profile_path(request_id, '.json')
+    if not path.exists():
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    stream = io.StringIO()
+    stats = pstats.Stats(str(profile_path(request_id, '.prof')), stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+    data['top_functions'] = stream.getvalue()
+    return data
+
+
+class SQLTrace:
+    """
+    Execute wrapper that records every query run on the connection
+    together with its duration.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': repr(params),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+class ProfilingMixin:
+    """
+    Runs cProfile and an SQL trace around the view when requested.
+
+    Admins turn profiling on for a single request with the `X-Profile: 1`
+    header or `?profile=1`. Independently, PROFILING['SAMPLE_RATE'] profiles
+    that fraction of all requests for continuous low-overhead collection.
+
+    The profile (`<request id>.prof`) and metadata with the SQL trace
+    (`<request id>.json`) are written to PROFILING['DIRECTORY'], which keeps
+    the PROFILING['MAX_PROFILES'] most recent ones. Admin-requested profiles
+    are named after the X-Request-ID header when it is safe to use as a file
+    name; sampled profiles always get a generated id, so other clients can't
+    overwrite them. The id is returned in X-Request-ID.
+
+    Profiling is always stopped when the request ends, including when the
+    view raises, in which case the profile is saved with status 500.
+    """
+
+    def profiling_requested(self, request):
+        user = request.user
+        is_admin = bool(user and user.is_authenticated and user.role == 'admin')
+        if is_admin and (request.headers.get('X-Profile') == '1' or request.query_params.get('profile') == '1'):
+            return 'requested'
+        sample_rate = settings.PROFILING['SAMPLE_RATE']
+        if sample_rate and random.random() < sample_rate:
+            return 'sampled'
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        self._profiling = None
+        response = None
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+            return response
+        finally:
+            self.stop_profiling(response)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        trigger = self.profiling_requested(request)
+        if trigger is None:
+            return
+
+        request_id = request.headers.get('X-Request-ID', '') if trigger == 'requested' else ''
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this process
+            return
+        stack = ExitStack()
+        stack.callback(profiler.disable)
+        trace = SQLTrace()
+        stack.enter_context(connection.execute_wrapper(trace))
+        self._profiling = {
+            'request_id': request_id,
+            'trigger': trigger,
+            'stack': stack,
+            'trace': trace,
+            'profiler': profiler,
+            'started': time.perf_counter(),
+        }
+
+    def stop_profiling(self, response):
+        """
+        Removes the profiler and SQL trace and saves what they collected.
+        `response` is None when the view raised an uncaught exception.
+        """
+        profiling = self._profiling
+        if profiling is None:
+            return
+
+        self._profiling = None
+        profiling['stack'].close()
+        duration_ms = (time.perf_counter() - profiling['started']) * 1000
+        request_id = profiling['request_id']
+        request = self.request
+
+        profile_dir().mkdir(parents=True, exist_ok=True)
+        profiling['profiler'].dump_stats(profile_path(request_id, '.prof'))
+        queries = profiling['trace'].queries
+        metadata = {
+            'request_id': request_id,
+            'created_at': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': type(self).__name__,
+            'action': getattr(self, 'action', None),
+            'user': request.user.pk if request.user.is_authenticated else None,
+            'trigger': profiling['trigger'],
+            'status_code': response.status_code if response is not None else 500,
+            'duration_ms': round(duration_ms, 3),
+            'query_count': len(queries),
+            'sql_duration_ms': round(sum(query['duration_ms'] for query in queries), 3),
+            'queries': queries,
+        }
+        with open(profile_path(request_id, '.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        prune_profiles(settings.PROFILING['MAX_PROFILES'])
+
+        if response is not None:
+            response['X-Request-ID'] = request_id
@@ -1,12 +1,22 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import User, Ride, RideEvent
+from .models import User, Ride, RideEvent, ArchivedRide, ChangeLogEntry
 from django.db.models import Prefetch
 from datetime import datetime, timedelta
 import math
 
 User = get_user_model()
 
+
+def parse_list_param(request, name):
+    """
+    Returns the comma-separated values of a query parameter as a set,
+    or None if the parameter was not supplied.
+    """
+    if request is None or name not in request.query_params:
+        return None
+    return {value.strip() for value in request.query_params[name].split(',') if value.strip()}
+
 class UserSerializer(serializers.ModelSerializer):
     """
     Serializer for User model.
@@ -35,11 +45,10 @@ class UserSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         password = validated_data.pop('password', None)
-        user = super().update(instance, validated_data)
         if password:
-            user.set_password(password)
-            user.save()
-        return user
+            # Set before saving so the update is written in a single query
+            instance.set_password(password)
+        return super().update(instance, validated_data)
 
 class RideEventSerializer(serializers.ModelSerializer):
     """
@@ -55,7 +64,17 @@ class RideSerializer(serializers.ModelSerializer):
     """
     Serializer for Ride model with optimized related field handling.
     Includes nested serializers for rider, driver, and today's ride events.
+
+    Supports sparse fieldsets and opt-in expansion through the request:
+    - ?fields=id_ride,status,pickup_time limits the output to those fields
+      (input is validated in full)
+    - ?expand=rider,driver,todays_ride_events embeds only the listed relations;
+      rider and driver are returned as plain ids when not expanded and
+      todays_ride_events is omitted
+    Without either parameter the full representation is returned.
     """
+    EXPANDABLE_FIELDS = ('rider', 'driver', 'todays_ride_events')
+
     rider = UserSerializer(read_only=True)
     driver = UserSerializer(read_only=True)
     rider_id = serializers.PrimaryKeyRelatedField(
@@ -78,6 +97,45 @@ class RideSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['id_ride', 'todays_ride_events', 'distance_to_pickup']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        expand = parse_list_param(request, 'expand')
+        fields = parse_list_param(request, 'fields')
+
+        if expand is not None:
+            for name in ('rider', 'driver'):
+                if name not in expand:
+                    # Read the raw foreign key column so no JOIN is needed
+                    self.fields[name] = serializers.IntegerField(source=f'{name}_id', read_only=True)
+            if 'todays_ride_events' not in expand:
+                self.fields.pop('todays_ride_events')
+
+        # Applied to the output only, so writes still validate every field
+        self.requested_fields = fields
+
+    @property
+    def _readable_fields(self):
+        # Fields to_representation renders
+        for field in super()._readable_fields:
+            if self.requested_fields is None or field.field_name in self.requested_fields:
+                yield field
+
+    @classmethod
+    def requested_relations(cls, request):
+        """
+        Returns the expandable relations the request will actually render,
+        so the view can skip select_related and Prefetch work for the rest.
+        """
+        relations = set(cls.EXPANDABLE_FIELDS)
+        expand = parse_list_param(request, 'expand')
+        if expand is not None:
+            relations &= expand
+        fields = parse_list_param(request, 'fields')
+        if fields is not None:
+            relations &= fields
+        return relations
+
     def get_todays_ride_events(self, obj):
         """
         Returns ride events from the last 24 hours.
@@ -113,4 +171,25 @@ class RideSerializer(serializers.ModelSerializer):
 
             return round(distance, 2)
         except (ValueError, TypeError):
-            return None 
\ No newline at end of file
+            return None 
+
+
+class ArchivedRideSerializer(RideSerializer):
+    """
+    Read-only representation of archived rides, identical to RideSerializer
+    plus the archived_at timestamp.
+    """
+    class Meta(RideSerializer.Meta):
+        model = ArchivedRide
+        read_only_fields = RideSerializer.Meta.read_only_fields + ['archived_at']
+
+
+class ChangeLogEntrySerializer(serializers.ModelSerializer):
+    """
+    Serializer for the change feed. Deltas carry raw column values and
+    foreign key ids rather than nested objects to keep them compact.
+    """
+    class Meta:
+        model = ChangeLogEntry
+        fields = ['seq', 'model', 'object_id', 'action', 'data', 'created_at']
+        read_only_fields = fields
@@ -0,0 +1,117 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import ChangeLogEntry, DriverRideCount, Ride, RideEvent, User
+
+CHANGE_LOG_MODELS = {
+    Ride: 'ride',
+    RideEvent: 'ride_event',
+}
+
+_state = threading.local()
+
+
+@contextmanager
+def archiving():
+    """
+    Marks the rides and events deleted inside the block as moved to the
+    archive rather than deleted, so log_delete doesn't record them.
+    The archiver logs one 'archive' entry per ride instead.
+    """
+    _state.archiving = True
+    try:
+        yield
+    finally:
+        _state.archiving = False
+
+
+def row_values(instance):
+    """
+    Returns the instance's column values keyed by attribute name
+    (foreign keys as plain ids, e.g. rider_id), without touching relations.
+    """
+    return {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+
+
+@receiver(post_save, sender=Ride)
+@receiver(post_save, sender=RideEvent)
+def log_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    ChangeLogEntry.objects.create(
+        model=CHANGE_LOG_MODELS[sender],
+        object_id=instance.pk,
+        action='create' if created else 'update',
+        data=row_values(instance),
+    )
+
+
+@receiver(post_delete, sender=Ride)
+@receiver(post_delete, sender=RideEvent)
+def log_delete(sender, instance, **kwargs):
+    if getattr(_state, 'archiving', False):
+        return
+    ChangeLogEntry.objects.create(
+        model=CHANGE_LOG_MODELS[sender],
+        object_id=instance.pk,
+        action='delete',
+    )
+
+
+@receiver(pre_delete, sender=User)
+def log_detached_rides(sender, instance, **kwargs):
+    """
+    Deleting a user sets Ride.rider and Ride.driver to NULL with a queryset
+    UPDATE, which sends no signals, so those ride updates are logged here.
+    Runs inside the delete's transaction.
+    """
+    entries = []
+    for ride in Ride.objects.filter(Q(rider=instance) | Q(driver=instance)):
+        if ride.rider_id == instance.pk:
+            ride.rider_id = None
+        if ride.driver_id == instance.pk:
+            ride.driver_id = None
+        entries.append(ChangeLogEntry(model='ride', object_id=ride.pk, action='update', data=row_values(ride)))
+    if entries:
+        ChangeLogEntry.objects.bulk_create(entries)
+
+
+def adjust_driver_ride_count(driver_id, status, delta):
+    if driver_id is None:
+        return
+    counts = DriverRideCount.objects.filter(driver_id=driver_id, status=status)
+    if counts.update(count=F('count') + delta):
+        return
+    if delta < 0:
+        # No counter yet (rides from before the counters existed); creating
+        # one would start it below zero. rebuild_driver_ride_counts fixes it.
+        return
+    try:
+        with transaction.atomic():
+            DriverRideCount.objects.create(driver_id=driver_id, status=status, count=delta)
+    except IntegrityError:
+        # Created concurrently by another request
+        counts.update(count=F('count') + delta)
+
+
+@receiver(post_save, sender=Ride)
+def count_saved_ride(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = (instance.driver_id, instance.status)
+    previous = None if created else getattr(instance, '_previous_state', None)
+    if previous == current:
+        return
+    if previous is not None:
+        adjust_driver_ride_count(*previous, -1)
+    adjust_driver_ride_count(*current, 1)
+
+
+@receiver(post_delete, sender=Ride)
+def count_deleted_ride(sender, instance, **kwargs):
+    adjust_driver_ride_count(instance.driver_id, instance.status, -1)
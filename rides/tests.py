@@ -1,3 +1,992 @@
-from django.test import TestCase
+import gzip
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from .bulk_import import MIN_PARALLEL_PASSWORDS, hash_passwords
+from .middleware import CompressionMiddleware, brotli
+from .models import ArchivedRide, ArchivedRideEvent, ArchiveRun, DriverRideCount, Ride, RideEvent, User
+from .profiling import list_profiles, load_profile
+from .renderers import MessagePackParser, MessagePackRenderer
+from .views import RideEventViewSet, RideViewSet, UserViewSet
+
+
+class QueryBudgetMixin:
+    """
+    Assertions that pin the number of SQL queries an endpoint runs and
+    check that its queries are served from indexes. Failures include the
+    offending SQL so regressions can be diagnosed from the test output.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, expected):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed != expected:
+            queries = '\n'.join(
+                f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail(f'Expected {expected} queries, {executed} were executed:\n{queries}')
+
+    def assertUsesIndexes(self, queryset):
+        """
+        Fails if the query plan does a full scan of the queryset's table.
+        """
+        table = queryset.model._meta.db_table
+        plan = queryset.explain()
+        full_scans = [
+            line for line in plan.splitlines()
+            if re.search(rf'\bSCAN {table}\b(?! USING)', line)
+        ]
+        if full_scans:
+            self.fail(f'Full scan of {table}:\n{plan}\n\nSQL: {queryset.query}')
+
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'throttle': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttle'},
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RideApiTestCase(QueryBudgetMixin, TestCase):
+    """
+    Creates users and ride_count rides (each with one event) that the
+    query budget tests run against. Subclasses change the data volume to
+    show query counts don't grow with it.
+    """
+    ride_count = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', password='x', role='admin', email='admin@example.com')
+        cls.driver = User.objects.create_user(username='driver', password='x', role='driver', email='driver@example.com')
+        cls.rider = User.objects.create_user(username='rider', password='x', role='rider', email='rider@example.com')
+
+        now = timezone.now()
+        for i in range(cls.ride_count):
+            ride = Ride.objects.create(
+                rider=cls.rider, driver=cls.driver, status='en-route',
+                pickup_latitude=37.77 + i / 1000, pickup_longitude=-122.41,
+                dropoff_latitude=37.78, dropoff_longitude=-122.41,
+                pickup_time=now - timedelta(minutes=i),
+            )
+            RideEvent.objects.create(ride=ride, description='Status changed to en-route')
+
+            archived = ArchivedRide.objects.create(
+                id_ride=100000 + i, rider=cls.rider, driver=cls.driver, status='completed',
+                pickup_latitude=37.77, pickup_longitude=-122.41,
+                dropoff_latitude=37.78, dropoff_longitude=-122.41,
+                pickup_time=now - timedelta(days=365),
+            )
+            ArchivedRideEvent.objects.create(
+                id_ride_event=100000 + i, ride=archived,
+                description='Status changed to dropoff', created_at=now - timedelta(days=365),
+            )
+        cls.ride = ride
+
+        # Steady state: the driver already has a counter row for every status,
+        # so ride writes adjust counts with a single UPDATE each
+        for ride_status, _ in Ride.STATUS_CHOICES:
+            DriverRideCount.objects.get_or_create(driver=cls.driver, status=ride_status)
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def ride_payload(self, **overrides):
+        payload = {
+            'rider_id': self.rider.pk,
+            'driver_id': self.driver.pk,
+            'pickup_latitude': 37.7749,
+            'pickup_longitude': -122.4194,
+            'dropoff_latitude': 37.7833,
+            'dropoff_longitude': -122.4167,
+            'pickup_time': '2024-05-04T10:00:00Z',
+        }
+        payload.update(overrides)
+        return payload
+
+
+class RideViewSetQueryBudgetTests(RideApiTestCase):
+
+    def test_list(self):
+        last_page = (self.ride_count - 1) // 10 + 1
+        for query in ('', f'?page={last_page}', '?status=en-route', '?rider__email=rider@example.com'):
+            with self.subTest(query=query), self.assertQueryBudget(3):
+                response = self.client.get(f'/api/rides/{query}')
+            self.assertEqual(response.status_code, 200)
+
+        for page_size in (1, 10, 100):
+            with self.subTest(page_size=page_size), self.assertQueryBudget(3):
+                response = self.client.get(f'/api/rides/?page_size={page_size}')
+            self.assertEqual(len(response.data['results']), min(page_size, self.ride_count))
+
+    def test_list_ordered_by_distance(self):
+        with self.assertQueryBudget(3):
+            response = self.client.get('/api/rides/?ordering=distance_to_pickup&latitude=37.7&longitude=-122.4')
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_sparse_fields_skip_joins_and_prefetch(self):
+        with self.assertQueryBudget(2) as context:
+            response = self.client.get('/api/rides/?fields=id_ride,status,pickup_time')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('JOIN', context.captured_queries[-1]['sql'])
+
+        with self.assertQueryBudget(2):
+            response = self.client.get('/api/rides/?expand=rider,driver')
+        self.assertEqual(response.status_code, 200)
+
+    def test_write_with_sparse_fields_validates_every_field(self):
+        response = self.client.post('/api/rides/?fields=id_ride', self.ride_payload(), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(response.data), ['id_ride'])
+
+        response = self.client.post('/api/rides/?fields=id_ride', {'rider_id': self.rider.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pickup_latitude', response.data)
+
+    def test_list_archived(self):
+        with self.assertQueryBudget(3):
+            response = self.client.get('/api/rides/?archived=true')
+        self.assertEqual(response.data['count'], self.ride_count)
+
+    def test_retrieve(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(f'/api/rides/{self.ride.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_create(self):
+        # rider_id and driver_id lookups, the INSERT, its change log entry and the driver's count
+        with self.assertQueryBudget(5):
+            response = self.client.post('/api/rides/', self.ride_payload(), format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_update(self):
+        # get_object (2), rider/driver lookups (2), previous status, pickup event, UPDATE,
+        # a change log entry for both writes and moving the driver's count between statuses
+        with self.assertQueryBudget(11):
+            response = self.client.put(
+                f'/api/rides/{self.ride.pk}/', self.ride_payload(status='pickup'), format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_partial_update(self):
+        with self.assertQueryBudget(9):
+            response = self.client.patch(f'/api/rides/{self.ride.pk}/', {'status': 'dropoff'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_destroy(self):
+        # The events are loaded so each delete can be written to the change log
+        with self.assertQueryBudget(8):
+            response = self.client.delete(f'/api/rides/{self.ride.pk}/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_events(self):
+        with self.assertQueryBudget(3):
+            response = self.client.get(f'/api/rides/{self.ride.pk}/events/')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertQueryBudget(4):
+            response = self.client.post(
+                f'/api/rides/{self.ride.pk}/events/', {'description': 'Driver arrived'}, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+
+
+class RideViewSetLargeQueryBudgetTests(RideViewSetQueryBudgetTests):
+    ride_count = 60
+
+
+class MessagePackTests(RideApiTestCase):
+
+    def test_render_parse_round_trip(self):
+        now = timezone.now()
+        data = {'id': 1, 'price': Decimal('12.50'), 'pickup_time': now, 'tags': ['a', 'b'], 'driver': None}
+        body = MessagePackRenderer().render(data)
+        parsed = MessagePackParser().parse(BytesIO(body))
+        self.assertEqual(parsed, {
+            'id': 1, 'price': 12.5, 'pickup_time': now.isoformat().replace('+00:00', 'Z'),
+            'tags': ['a', 'b'], 'driver': None,
+        })
+
+    def test_invalid_body_is_a_parse_error(self):
+        response = self.client.post(
+            f'/api/rides/{self.ride.pk}/events/', b'\xc1', content_type='application/msgpack'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_accept_negotiation(self):
+        for kwargs in ({'HTTP_ACCEPT': 'application/msgpack'}, {'data': {'format': 'msgpack'}}):
+            with self.subTest(kwargs=kwargs):
+                response = self.client.get('/api/rides/', **kwargs)
+                self.assertEqual(response['Content-Type'], 'application/msgpack')
+                self.assertEqual(msgpack.unpackb(response.content)['count'], self.ride_count)
+
+        response = self.client.get('/api/rides/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_msgpack_request_body(self):
+        body = msgpack.packb({'description': 'Driver arrived'})
+        response = self.client.post(
+            f'/api/rides/{self.ride.pk}/events/', body, content_type='application/msgpack'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['description'], 'Driver arrived')
+
+
+@override_settings(COMPRESSION_MIN_SIZE=1024, COMPRESSION_BROTLI_QUALITY=5)
+class CompressionMiddlewareTests(SimpleTestCase):
+    content = b'{"status": "en-route", "pickup_latitude": 37.7749}' * 100
+
+    def process(self, response, accept_encoding):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.process(HttpResponse(b'{"id": 1}'), 'gzip, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+
+    def test_gzip(self):
+        response = self.process(HttpResponse(self.content), 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(gzip.decompress(response.content), self.content)
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_is_preferred_and_padded(self):
+        lengths = set()
+        for _ in range(10):
+            response = self.process(HttpResponse(self.content), 'gzip, deflate, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(response['Content-Length'], str(len(response.content)))
+            self.assertEqual(brotli.decompress(response.content), self.content)
+            lengths.add(len(response.content))
+        # Random padding varies the compressed length (BREACH mitigation)
+        self.assertGreater(len(lengths), 1)
+
+    def test_refused_encodings(self):
+        response = self.process(HttpResponse(self.content), 'br;q=0, gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response.content, self.content)
+
+        response = self.process(HttpResponse(self.content), 'br;q=0, gzip;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_strong_etag_becomes_weak(self):
+        response = HttpResponse(self.content)
+        response['ETag'] = '"abc"'
+        response = self.process(response, 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_already_encoded_responses_pass_through(self):
+        response = HttpResponse(self.content)
+        response['Content-Encoding'] = 'identity'
+        response = self.process(response, 'gzip')
+        self.assertEqual(response.content, self.content)
+
+    def test_streaming_gzip(self):
+        chunks = [self.content] * 3
+        response = self.process(StreamingHttpResponse(iter(chunks)), 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(chunks))
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_streaming_brotli_sends_each_chunk_as_it_arrives(self):
+        sent = []
+
+        def chunks():
+            for i in range(3):
+                sent.append(i)
+                yield self.content
+
+        response = self.process(StreamingHttpResponse(chunks()), 'br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        decompressor = brotli.Decompressor()
+        received = b''
+        for data in response.streaming_content:
+            received += decompressor.process(data)
+            # Everything produced so far has already been flushed to the client
+            self.assertEqual(received, self.content * len(sent))
+        self.assertEqual(received, self.content * 3)
+
+
+class ArchiveTests(RideApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.old_rides = []
+        for i in range(5):
+            ride = Ride.objects.create(
+                rider=cls.rider, driver=cls.driver, status='completed',
+                pickup_latitude=37.77, pickup_longitude=-122.41,
+                dropoff_latitude=37.78, dropoff_longitude=-122.41,
+                pickup_time=now - timedelta(days=200 + i),
+            )
+            RideEvent.objects.create(ride=ride, description='Status changed to dropoff')
+            cls.old_rides.append(ride)
+        cls.old_pending = Ride.objects.create(
+            rider=cls.rider, status='pending', pickup_latitude=37.77, pickup_longitude=-122.41,
+            dropoff_latitude=37.78, dropoff_longitude=-122.41, pickup_time=now - timedelta(days=400),
+        )
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_rides', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_moves_nothing(self):
+        output = self.archive('--dry-run')
+        self.assertIn('5 rides', output)
+        self.assertEqual(Ride.objects.filter(status='completed').count(), 5)
+        self.assertEqual(ArchivedRide.objects.count(), self.ride_count)
+
+    def test_batches_resume_and_move_events(self):
+        old_ids = [ride.pk for ride in self.old_rides]
+        self.archive('--batch-size', '2', '--max-batches', '2')
+        self.assertEqual(Ride.objects.filter(pk__in=old_ids).count(), 1)
+        self.assertFalse(ArchiveRun.objects.exists())
+
+        self.archive('--batch-size', '2')
+        self.assertFalse(Ride.objects.filter(pk__in=old_ids).exists())
+        self.assertFalse(RideEvent.objects.filter(ride_id__in=old_ids).exists())
+        self.assertEqual(ArchivedRide.objects.filter(pk__in=old_ids).count(), 5)
+        self.assertEqual(ArchivedRideEvent.objects.filter(ride_id__in=old_ids).count(), 5)
+        self.assertTrue(ArchiveRun.objects.exists())
+        # Rides that aren't completed or cancelled are never archived
+        self.assertTrue(Ride.objects.filter(pk=self.old_pending.pk).exists())
+
+    def test_invalid_date_is_a_validation_error(self):
+        for params in ({}, {'status': 'completed'}):
+            with self.subTest(params=params):
+                response = self.client.get(
+                    '/api/rides/', {'pickup_time_before': '2024-13-01T00:00:00', **params}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('pickup_time_before', response.data)
+
+    def test_old_date_range_keeps_hot_rides(self):
+        before = (timezone.now() - timedelta(days=91)).isoformat()
+        response = self.client.get('/api/rides/', {'pickup_time_before': before})
+        self.assertEqual(response.data['count'], 6)
+
+        # Nothing has been archived up to this cutoff yet
+        response = self.client.get('/api/rides/', {'pickup_time_before': before, 'status': 'completed'})
+        self.assertEqual(response.data['count'], 5)
+
+        self.archive()
+        response = self.client.get('/api/rides/', {'pickup_time_before': before, 'status': 'completed'})
+        self.assertEqual(response.data['count'], 5 + self.ride_count)
+        self.assertIn('archived_at', response.data['results'][0])
+        response = self.client.get('/api/rides/', {'pickup_time_before': before})
+        self.assertEqual(response.data['count'], 1)
+
+
+class RideEventViewSetQueryBudgetTests(RideApiTestCase):
+
+    def call(self, method, action, data=None):
+        request = getattr(APIRequestFactory(), method)('/', data, format='json')
+        force_authenticate(request, self.admin)
+        view = RideEventViewSet.as_view({method: action})
+        return view(request, ride_pk=self.ride.pk)
+
+    def test_list(self):
+        with self.assertQueryBudget(2):
+            response = self.call('get', 'list')
+        self.assertEqual(response.status_code, 200)
+
+    def test_create(self):
+        with self.assertQueryBudget(2):
+            response = self.call('post', 'create', {'description': 'Driver arrived'})
+        self.assertEqual(response.status_code, 201)
+
+
+class UserViewSetQueryBudgetTests(RideApiTestCase):
+
+    def test_list(self):
+        User.objects.bulk_create([User(username=f'user{i}', role='rider') for i in range(30)])
+        for page_size in (1, 10, 100):
+            with self.subTest(page_size=page_size), self.assertQueryBudget(2):
+                response = self.client.get(f'/api/users/?page_size={page_size}')
+            self.assertEqual(response.status_code, 200)
+
+    def test_search(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get('/api/users/?search=driver&role=driver')
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(f'/api/users/{self.driver.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_me(self):
+        with self.assertQueryBudget(0):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_create(self):
+        # username uniqueness check, then the INSERT
+        with self.assertQueryBudget(2):
+            response = self.client.post(
+                '/api/users/', {'username': 'new', 'password': 'a-long-password'}, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_update(self):
+        with self.assertQueryBudget(3):
+            response = self.client.put(
+                f'/api/users/{self.driver.pk}/', {'username': 'driver', 'password': 'a-new-password'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_partial_update(self):
+        with self.assertQueryBudget(2):
+            response = self.client.patch(f'/api/users/{self.driver.pk}/', {'first_name': 'Jane'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_destroy(self):
+        # get_object, logging the rides that lose their rider (a SELECT and one INSERT),
+        # then the delete cascade across groups, permissions, admin log, rides and ride counts
+        with self.assertQueryBudget(12):
+            response = self.client.delete(f'/api/users/{self.rider.pk}/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_bulk_import(self):
+        rows = [{'username': f'bulk{i}', 'password': 'x', 'role': 'driver'} for i in range(20)]
+        # uniqueness check and one INSERT inside a savepoint, whatever the row count
+        with self.assertQueryBudget(4):
+            response = self.client.post('/api/users/bulk-import/', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class BulkImportTests(RideApiTestCase):
+
+    def test_rows_are_validated_like_the_create_endpoint(self):
+        rows = [
+            {'username': 'u' * 300, 'password': 'x', 'phone_number': '1' * 50},
+            {'username': 'bad user!!', 'password': 'x', 'email': 'notanemail'},
+            {'username': 'norole', 'password': 'x', 'role': 'pilot'},
+            {'username': 'nopassword'},
+            {'username': 'driver', 'password': 'x'},
+            {'username': 'twice', 'password': 'x'},
+            {'username': 'twice', 'password': 'x'},
+        ]
+        response = self.client.post('/api/users/bulk-import/', rows, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['errors']
+        self.assertEqual(set(errors[0]), {'username', 'phone_number'})
+        self.assertEqual(set(errors[1]), {'username', 'email'})
+        self.assertEqual(set(errors[2]), {'role'})
+        self.assertEqual(set(errors[3]), {'password'})
+        self.assertIn('already exists', str(errors[4]['username']))
+        self.assertNotIn(5, errors)
+        self.assertIn('Duplicate of row 5', str(errors[6]['username']))
+        self.assertFalse(User.objects.filter(username='twice').exists())
+
+    def test_non_string_password_is_hashed(self):
+        response = self.client.post(
+            '/api/users/bulk-import/', [{'username': 'numeric', 'password': 123}], format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.get(username='numeric').check_password('123'))
+
+    @override_settings(BULK_IMPORT_MAX_ROWS=2)
+    def test_request_size_is_capped(self):
+        rows = [{'username': f'capped{i}', 'password': 'x'} for i in range(3)]
+        response = self.client.post('/api/users/bulk-import/', rows, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_parallel_hashing_preserves_order(self):
+        passwords = [f'password-{i}' for i in range(MIN_PARALLEL_PASSWORDS)]
+        hashed = hash_passwords(passwords, workers=2)
+        self.assertEqual(len(hashed), len(passwords))
+        for password, encoded in zip(passwords, hashed):
+            self.assertTrue(check_password(password, encoded))
+
+    def test_import_users_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            self.addCleanup(os.unlink, f.name)
+            f.write('username,password,role,email\n')
+            for i in range(MIN_PARALLEL_PASSWORDS):
+                f.write(f'csv{i},pass-{i},driver,\n')
+        out = StringIO()
+        call_command('import_users', f.name, '--workers', '2', '--batch-size', '10', stdout=out)
+        self.assertIn(f'imported {MIN_PARALLEL_PASSWORDS} users', out.getvalue())
+        user = User.objects.get(username='csv7')
+        self.assertEqual(user.role, 'driver')
+        self.assertTrue(user.check_password('pass-7'))
+
+        # Importing the same file again fails without writing anything
+        with self.assertRaises(CommandError):
+            call_command('import_users', f.name, stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='csv').count(), MIN_PARALLEL_PASSWORDS)
+
+
+RATE_LIMITS = {
+    'CACHE': 'throttle',
+    'ROLES': {
+        'admin': {'capacity': 20, 'refill_rate': 0.01},
+        'driver': {'capacity': 10, 'refill_rate': 0.01},
+        'rider': {'capacity': 10, 'refill_rate': 0.01},
+        'anon': {'capacity': 10, 'refill_rate': 0.01},
+    },
+    'COSTS': {'default': 1, 'distance_ordering': 5, 'search': 5, 'clusters': 5, 'write': 2, 'bulk_import': 10},
+    'RESERVE': 0.25,
+}
+
+
+@override_settings(RATE_LIMITS=RATE_LIMITS)
+class TokenBucketThrottleTests(RideApiTestCase):
+
+    def test_expensive_requests_are_throttled_before_cheap_ones(self):
+        expensive = '/api/rides/?ordering=distance_to_pickup&latitude=37.7&longitude=-122.4'
+        # 20 tokens with 5 reserved: two expensive requests fit, the third doesn't
+        self.assertEqual(self.client.get(expensive).status_code, 200)
+        self.assertEqual(self.client.get(expensive).status_code, 200)
+        response = self.client.get(expensive)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # The reserve still serves cheap requests
+        self.assertEqual(self.client.get('/api/rides/').status_code, 200)
+
+    def test_throttled_request_runs_no_queries(self):
+        for _ in range(20):
+            self.client.get('/api/users/me/')
+        with self.assertQueryBudget(0):
+            response = self.client.get('/api/rides/')
+        self.assertEqual(response.status_code, 429)
+
+    def test_buckets_are_per_user_and_sized_by_role(self):
+        for _ in range(10):
+            self.client.get('/api/users/me/')
+        driver_client = APIClient()
+        driver_client.force_authenticate(self.driver)
+        for _ in range(10):
+            self.assertEqual(driver_client.get('/api/rides/').status_code, 200)
+        self.assertEqual(driver_client.get('/api/rides/').status_code, 429)
+        self.assertEqual(self.client.get('/api/rides/').status_code, 200)
+
+
+class ThrottleCacheTests(SimpleTestCase):
+
+    def test_buckets_are_not_culled_at_the_default_cache_size(self):
+        with tempfile.TemporaryDirectory() as location:
+            config = {**settings.CACHES['throttle'], 'LOCATION': location}
+            with override_settings(CACHES={**settings.CACHES, 'throttle': config}):
+                cache = caches.create_connection('throttle')
+                for i in range(400):
+                    cache.set(f'throttle_bucket_user_{i}', (0, 0), timeout=60)
+                self.assertEqual(len(os.listdir(location)), 400)
+
+
+class ChangeFeedTests(RideApiTestCase):
+
+    def test_sync_from_cursor(self):
+        cursor = self.client.get('/api/changes/').data['next']
+
+        ride = Ride.objects.create(
+            rider=self.rider, status='pending', pickup_latitude=1, pickup_longitude=2,
+            dropoff_latitude=1, dropoff_longitude=2, pickup_time=timezone.now(),
+        )
+        ride.status = 'pickup'
+        ride.save()
+        ride.delete()
+
+        response = self.client.get(f'/api/changes/?since={cursor}&limit=3')
+        changes = [(change['model'], change['action']) for change in response.data['results']]
+        self.assertEqual(changes, [('ride', 'create'), ('ride_event', 'create'), ('ride', 'update')])
+        self.assertEqual(response.data['results'][2]['data']['status'], 'pickup')
+        self.assertTrue(response.data['has_more'])
+
+        response = self.client.get(f'/api/changes/?since={response.data["next"]}')
+        changes = [(change['model'], change['action']) for change in response.data['results']]
+        self.assertEqual(changes, [('ride_event', 'delete'), ('ride', 'delete')])
+        self.assertFalse(response.data['has_more'])
+
+    def test_query_budget(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get('/api/changes/?since=0')
+        self.assertEqual(len(response.data['results']), self.ride_count * 2)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/changes/?since=abc').status_code, 400)
+
+    def test_archival_is_logged_once_per_ride(self):
+        cursor = self.client.get('/api/changes/').data['next']
+        ride = Ride.objects.create(
+            rider=self.rider, status='completed', pickup_latitude=1, pickup_longitude=2,
+            dropoff_latitude=1, dropoff_longitude=2, pickup_time=timezone.now() - timedelta(days=200),
+        )
+        RideEvent.objects.create(ride=ride, description='Status changed to dropoff')
+        cursor = self.client.get('/api/changes/').data['next']
+
+        call_command('archive_rides', stdout=StringIO())
+        response = self.client.get(f'/api/changes/?since={cursor}')
+        changes = [(change['model'], change['object_id'], change['action']) for change in response.data['results']]
+        self.assertEqual(changes, [('ride', ride.pk, 'archive')])
+
+    def test_user_delete_logs_detached_rides(self):
+        cursor = self.client.get('/api/changes/').data['next']
+        self.rider.delete()
+        response = self.client.get(f'/api/changes/?since={cursor}')
+        self.assertEqual(len(response.data['results']), self.ride_count)
+        for change in response.data['results']:
+            self.assertEqual((change['model'], change['action']), ('ride', 'update'))
+            self.assertIsNone(change['data']['rider_id'])
+            self.assertEqual(change['data']['driver_id'], self.driver.pk)
+
+    def test_limit_bounds(self):
+        for limit in ('-5', '0', '1001'):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.client.get(f'/api/changes/?since=0&limit={limit}').status_code, 400)
+        response = self.client.get('/api/changes/?since=0&limit=1')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertTrue(response.data['has_more'])
+
+
+class DriverRideHistoryTests(RideApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.driver_client = APIClient()
+        self.driver_client.force_authenticate(self.driver)
+
+    def test_pages_newest_first_with_precomputed_count(self):
+        response = self.driver_client.get('/api/users/me/rides/?page_size=2&fields=id_ride,pickup_time')
+        self.assertEqual(response.data['count'], self.ride_count)
+        first_page = [ride['id_ride'] for ride in response.data['results']]
+
+        response = self.driver_client.get(response.data['next'])
+        second_page = [ride['id_ride'] for ride in response.data['results']]
+        expected = list(Ride.objects.filter(driver=self.driver).order_by('-pickup_time').values_list('pk', flat=True))
+        self.assertEqual(first_page + second_page, expected[:4])
+
+    def test_query_budget(self):
+        # rides page, today's events and the precomputed count
+        with self.assertQueryBudget(3):
+            response = self.client.get(f'/api/users/{self.driver.pk}/rides/?status=en-route')
+        self.assertEqual(response.data['count'], self.ride_count)
+
+    def test_counts_follow_ride_changes(self):
+        self.ride.status = 'completed'
+        self.ride.save()
+        ride = Ride.objects.create(
+            rider=self.rider, driver=self.driver, status='pending', pickup_latitude=1, pickup_longitude=2,
+            dropoff_latitude=1, dropoff_longitude=2, pickup_time=timezone.now(),
+        )
+        ride.driver = self.admin
+        ride.save()
+        Ride.objects.filter(driver=self.driver).first().delete()
+
+        counts = dict(DriverRideCount.objects.filter(driver=self.driver).values_list('status', 'count'))
+        self.assertEqual(counts['en-route'], self.ride_count - 2)
+        self.assertEqual(counts['completed'], 1)
+        self.assertEqual(counts['pending'], 0)
+        self.assertEqual(DriverRideCount.objects.get(driver=self.admin, status='pending').count, 1)
+
+        DriverRideCount.objects.all().delete()
+        call_command('rebuild_driver_ride_counts', stdout=StringIO())
+        rebuilt = dict(DriverRideCount.objects.filter(driver=self.driver).values_list('status', 'count'))
+        self.assertEqual(rebuilt, {'en-route': self.ride_count - 2, 'completed': 1})
+
+    def test_archived_history(self):
+        response = self.driver_client.get('/api/users/me/rides/?archived=true&page_size=2')
+        self.assertEqual(response.data['count'], self.ride_count)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIn('archived_at', response.data['results'][0])
+
+    def test_decrement_without_counter_does_not_go_negative(self):
+        DriverRideCount.objects.filter(driver=self.driver).delete()
+        self.ride.delete()
+        self.assertFalse(DriverRideCount.objects.filter(driver=self.driver).exists())
+
+    def test_drivers_only_see_their_own_history(self):
+        self.assertEqual(self.driver_client.get(f'/api/users/{self.admin.pk}/rides/').status_code, 403)
+        self.assertEqual(self.client.get(f'/api/users/{self.driver.pk}/rides/').status_code, 200)
+
+
+class DriverRideCountMigrationTests(TransactionTestCase):
+    before = [('rides', '0005_pickup_coords_index')]
+    after = [('rides', '0006_driver_ride_history')]
+
+    def tearDown(self):
+        # Leave the schema fully migrated for the tests that follow
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_rides_are_counted(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        OldUser = apps.get_model('rides', 'User')
+        OldRide = apps.get_model('rides', 'Ride')
+        driver = OldUser.objects.create(username='driver', role='driver')
+        for ride_status in ('completed', 'completed', 'completed', 'pending', 'en-route'):
+            OldRide.objects.create(
+                driver=driver, status=ride_status, pickup_latitude=1, pickup_longitude=2,
+                dropoff_latitude=1, dropoff_longitude=2, pickup_time=timezone.now(),
+            )
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        counts = apps.get_model('rides', 'DriverRideCount').objects.filter(driver_id=driver.pk)
+        self.assertEqual(
+            dict(counts.values_list('status', 'count')),
+            {'completed': 3, 'pending': 1, 'en-route': 1},
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is parsed in SQLite format')
+class DriverRideHistoryQueryPlanTests(RideApiTestCase):
+
+    def test_history_pages_use_driver_indexes(self):
+        newest_first = Ride.objects.filter(driver=self.driver).order_by('-pickup_time')
+        for queryset in (newest_first, newest_first.filter(status='completed')):
+            plan = queryset[:10].explain()
+            self.assertUsesIndexes(queryset[:10])
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class MapViewportTests(RideApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Two pickups in Fiji on either side of the antimeridian
+        for longitude in (179.9, -179.9):
+            Ride.objects.create(
+                rider=cls.rider, status='pending', pickup_latitude=-17.7, pickup_longitude=longitude,
+                dropoff_latitude=-17.7, dropoff_longitude=longitude, pickup_time=timezone.now(),
+            )
+
+    def test_bbox_filter(self):
+        response = self.client.get('/api/rides/?bbox=-122.5,37.7,-122.3,37.9')
+        self.assertEqual(response.data['count'], self.ride_count)
+
+        response = self.client.get('/api/rides/?bbox=179,-18,-179,-17')
+        self.assertEqual(response.data['count'], 2)
+
+        self.assertEqual(self.client.get('/api/rides/?bbox=1,2,3').status_code, 400)
+
+    def test_clusters(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get('/api/rides/clusters/?zoom=2')
+        clusters = sorted(response.data['clusters'], key=lambda cluster: cluster['count'])
+        self.assertEqual([cluster['count'] for cluster in clusters], [1, 1, self.ride_count])
+        self.assertAlmostEqual(clusters[-1]['longitude'], -122.41)
+
+        response = self.client.get('/api/rides/clusters/?zoom=2&bbox=-180,0,0,90&status=en-route')
+        self.assertEqual([cluster['count'] for cluster in response.data['clusters']], [self.ride_count])
+
+        self.assertEqual(self.client.get('/api/rides/clusters/?zoom=99').status_code, 400)
+
+    def test_clusters_output_is_bounded(self):
+        # Without a bbox only low zooms are allowed
+        self.assertEqual(self.client.get('/api/rides/clusters/?zoom=5').status_code, 200)
+        self.assertEqual(self.client.get('/api/rides/clusters/?zoom=20').status_code, 400)
+
+        # A street-level viewport is fine at the highest zoom, a city-wide one isn't
+        response = self.client.get('/api/rides/clusters/?zoom=20&bbox=-122.411,37.77,-122.409,37.775')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(cluster['count'] for cluster in response.data['clusters']), self.ride_count)
+        response = self.client.get('/api/rides/clusters/?zoom=20&bbox=-122.5,37.7,-122.3,37.9')
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchRequestTests(RideApiTestCase):
+
+    def test_dashboard_batch(self):
+        response = self.client.post('/api/batch/', {'requests': [
+            {'method': 'GET', 'path': '/api/users/me/'},
+            {'method': 'GET', 'path': 'rides/?status=en-route&fields=id_ride,status'},
+            {'method': 'GET', 'path': f'/api/rides/{self.ride.pk}/events/'},
+            {'method': 'POST', 'path': f'/api/rides/{self.ride.pk}/events/', 'body': {'description': 'Driver arrived'}},
+            {'method': 'GET', 'path': f'/api/rides/{self.ride.pk}/events/'},
+            {'method': 'GET', 'path': '/api/rides/999999/'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [200, 200, 200, 201, 200, 404])
+        self.assertEqual(results[0]['body']['username'], 'admin')
+        self.assertEqual(results[1]['body']['count'], self.ride_count)
+        # The read after the write sees the new event
+        self.assertEqual(len(results[4]['body']), len(results[2]['body']) + 1)
+
+    def test_subrequests_use_batch_users_permissions(self):
+        rider_client = APIClient()
+        rider_client.force_authenticate(self.rider)
+        response = rider_client.post('/api/batch/', {'requests': [
+            {'path': '/api/users/me/'},
+            {'path': '/api/rides/'},
+        ]}, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 403])
+
+    def test_failing_subrequest_only_fails_its_entry(self):
+        with mock.patch.object(UserViewSet, 'me', side_effect=RuntimeError('boom')), \
+                self.assertLogs('rides.batch', 'ERROR'):
+            response = self.client.post('/api/batch/', {'requests': [
+                {'path': '/api/users/me/'},
+                {'path': '/api/rides/'},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [500, 200])
+        self.assertEqual(results[1]['body']['count'], self.ride_count)
+
+    def test_rejects_nested_and_non_api_requests(self):
+        response = self.client.post('/api/batch/', {'requests': [
+            {'method': 'POST', 'path': '/api/batch/', 'body': {'requests': []}},
+            {'path': '/admin/'},
+        ]}, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [400, 400])
+
+
+@override_settings(CACHES=TEST_CACHES, BATCH_REQUESTS={'MAX_REQUESTS': 20, 'MAX_WORKERS': 4})
+class ConcurrentBatchRequestTests(TransactionTestCase):
+
+    def test_reads_run_concurrently(self):
+        admin = User.objects.create_user(username='admin', password='x', role='admin')
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.post('/api/batch/', {'requests': [
+            {'path': '/api/users/me/'},
+            {'path': '/api/users/'},
+            {'path': '/api/rides/'},
+        ]}, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 200, 200])
+        self.assertEqual(response.data['results'][1]['body']['count'], 1)
+
+
+class ProfilingTests(RideApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.profile_dir = directory.name
+        profiling = override_settings(PROFILING={'DIRECTORY': self.profile_dir, 'SAMPLE_RATE': 0.0, 'MAX_PROFILES': 3})
+        profiling.enable()
+        self.addCleanup(profiling.disable)
+
+    def test_admin_profiles_request_and_downloads_it(self):
+        response = self.client.get('/api/rides/?profile=1', HTTP_X_REQUEST_ID='slow-rides-1')
+        self.assertEqual(response['X-Request-ID'], 'slow-rides-1')
+
+        profiles = self.client.get('/api/profiles/').data
+        self.assertEqual([profile['request_id'] for profile in profiles], ['slow-rides-1'])
+
+        detail = self.client.get('/api/profiles/slow-rides-1/').data
+        self.assertEqual(detail['query_count'], 3)
+        self.assertIn('rides_ride', detail['queries'][0]['sql'])
+        self.assertIn('cumulative', detail['top_functions'])
+
+        download = self.client.get('/api/profiles/slow-rides-1/download/')
+        self.assertEqual(download.status_code, 200)
+        self.assertTrue(b''.join(download.streaming_content))
+
+    def test_non_admin_cannot_request_profiling(self):
+        driver_client = APIClient()
+        driver_client.force_authenticate(self.driver)
+        response = driver_client.get('/api/rides/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Request-ID', response)
+        self.assertEqual(driver_client.get('/api/profiles/').status_code, 403)
+
+    def test_anonymous_client_cannot_list_profiles(self):
+        anonymous_client = APIClient()
+        self.assertEqual(anonymous_client.get('/api/profiles/').status_code, 401)
+        self.assertEqual(anonymous_client.get('/api/profiles/slow-rides-1/').status_code, 401)
+        self.assertEqual(anonymous_client.get('/api/rides/').status_code, 401)
+
+    def test_sample_rate_profiles_any_user_under_generated_ids(self):
+        driver_client = APIClient()
+        driver_client.force_authenticate(self.driver)
+        with override_settings(PROFILING={'DIRECTORY': self.profile_dir, 'SAMPLE_RATE': 1.0, 'MAX_PROFILES': 3}):
+            response = driver_client.get('/api/rides/', HTTP_X_REQUEST_ID='slow-rides-1')
+        self.assertIn('X-Request-ID', response)
+        self.assertNotEqual(response['X-Request-ID'], 'slow-rides-1')
+
+    def test_profiler_is_removed_when_the_view_raises(self):
+        with mock.patch.object(RideViewSet, 'list', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.client.get('/api/rides/?profile=1', HTTP_X_REQUEST_ID='failing-1')
+        self.assertIsNone(sys.getprofile())
+        self.assertEqual(connection.execute_wrappers, [])
+        self.assertEqual(load_profile('failing-1')['status_code'], 500)
+
+    def test_only_newest_profiles_are_kept(self):
+        for i in range(5):
+            self.client.get('/api/users/me/?profile=1', HTTP_X_REQUEST_ID=f'profile-{i}')
+            # Keep modification times distinct on coarse-grained filesystems
+            os.utime(os.path.join(self.profile_dir, f'profile-{i}.json'), (i, i))
+        self.assertEqual(
+            sorted(profile['request_id'] for profile in list_profiles()),
+            ['profile-2', 'profile-3', 'profile-4'],
+        )
+        self.assertEqual(len(os.listdir(self.profile_dir)), 6)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is parsed in SQLite format')
+class RideQueryPlanTests(RideApiTestCase):
+    """
+    The rides list queries, as built by RideViewSet, must not full-scan the rides table.
+    """
+
+    def list_queryset(self, query):
+        request = APIRequestFactory().get('/api/rides/', query)
+        force_authenticate(request, self.admin)
+        view = RideViewSet(action_map={'get': 'list'}, action='list', format_kwarg=None, args=(), kwargs={})
+        view.request = view.initialize_request(request)
+        return view.filter_queryset(view.get_queryset())
+
+    def test_default_ordering(self):
+        self.assertUsesIndexes(self.list_queryset({}))
+
+    def test_status_filter(self):
+        self.assertUsesIndexes(self.list_queryset({'status': 'en-route'}))
+
+    def test_rider_email_filter(self):
+        self.assertUsesIndexes(self.list_queryset({'rider__email': 'rider@example.com'}))
+
+    def test_bbox_filter(self):
+        self.assertUsesIndexes(self.list_queryset({'bbox': '-122.5,37.7,-122.3,37.9'}))
+
+    def test_archived_date_range(self):
+        self.assertUsesIndexes(self.list_queryset({
+            'archived': 'true',
+            'pickup_time_before': (timezone.now() - timedelta(days=100)).isoformat(),
+        }))
@@ -0,0 +1,97 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+
+def request_cost(request, view):
+    """
+    Returns how many tokens a request consumes.
+
+    Cheap reads cost the default weight; distance ordering, search, map
+    clustering, writes and bulk imports add their configured weight on top
+    of it.
+    """
+    costs = settings.RATE_LIMITS['COSTS']
+    cost = costs['default']
+    params = request.query_params
+    if 'distance_to_pickup' in params.get('ordering', ''):
+        cost += costs['distance_ordering']
+    if params.get('search'):
+        cost += costs['search']
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        cost += costs['write']
+    action = getattr(view, 'action', None)
+    if action == 'clusters':
+        cost += costs['clusters']
+    if action == 'bulk_import':
+        cost += costs['bulk_import']
+    return cost
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Cost-weighted token bucket per client, sized by the client's role.
+
+    Each bucket holds up to `capacity` tokens and refills at `refill_rate`
+    tokens per second. Requests take `request_cost()` tokens; when the
+    bucket can't cover them the request is rejected with 429 and a
+    Retry-After header before the view runs any queries.
+
+    Expensive requests may not dip into the last `reserve` fraction of the
+    bucket, so a burst of them is throttled while cheap requests from the
+    same client keep being served.
+
+    Bucket state lives in the RATE_LIMITS['CACHE'] cache so all worker
+    processes share it. Reads and writes of a bucket are not atomic, so
+    concurrent requests from the same client can occasionally both be
+    admitted; the limits are approximate by design.
+    """
+    cache_format = 'throttle_bucket_%(ident)s'
+
+    def get_bucket_config(self, request):
+        user = request.user
+        role = getattr(user, 'role', None) if user and user.is_authenticated else 'anon'
+        roles = settings.RATE_LIMITS['ROLES']
+        return roles.get(role, roles['anon'])
+
+    def get_cache_key(self, request):
+        user = request.user
+        if user and user.is_authenticated:
+            ident = f'user_{user.pk}'
+        else:
+            ident = f'anon_{self.get_ident(request)}'
+        return self.cache_format % {'ident': ident}
+
+    def allow_request(self, request, view):
+        cache = caches[settings.RATE_LIMITS['CACHE']]
+        config = self.get_bucket_config(request)
+        capacity = config['capacity']
+        refill_rate = config['refill_rate']
+        cost = request_cost(request, view)
+
+        key = self.get_cache_key(request)
+        now = time.time()
+        tokens, updated_at = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+
+        floor = 0
+        if cost > settings.RATE_LIMITS['COSTS']['default']:
+            floor = capacity * settings.RATE_LIMITS['RESERVE']
+        required = floor + cost
+
+        if tokens < required:
+            self.wait_seconds = (min(required, capacity) - tokens) / refill_rate
+            cache.set(key, (tokens, now), timeout=self.state_timeout(capacity, refill_rate))
+            return False
+
+        cache.set(key, (tokens - cost, now), timeout=self.state_timeout(capacity, refill_rate))
+        return True
+
+    def state_timeout(self, capacity, refill_rate):
+        # After this long an idle bucket is full again and can be forgotten
+        return int(capacity / refill_rate) + 1
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
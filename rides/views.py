@@ -1,39 +1,146 @@
+import math
+
+from django.conf import settings
+from django.http import FileResponse, Http404
 from django.shortcuts import render
-from rest_framework import viewsets, permissions, filters, status
+from rest_framework import viewsets, mixins, permissions, filters, status
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Prefetch, Q
+from django.db.models import Avg, Count, F, Prefetch, Q, Sum
+from django.db.models.functions import Floor
+from django_filters.utils import translate_validation
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import datetime, timedelta
-from .models import Ride, RideEvent, User
-from .serializers import RideSerializer, UserSerializer, RideEventSerializer
+from .models import Ride, RideEvent, ArchivedRide, ArchivedRideEvent, ChangeLogEntry, DriverRideCount, User
+from .serializers import (
+    RideSerializer, UserSerializer, RideEventSerializer, ArchivedRideSerializer, ChangeLogEntrySerializer,
+)
+from .filters import RideFilter, ArchivedRideFilter
+from .archive import ARCHIVED_STATUSES, archive_watermark
+from .profiling import ProfilingMixin, REQUEST_ID_RE, list_profiles, load_profile, profile_path
+from .bulk_import import BulkImportError, bulk_import_users
+from .batch import run_batch
 from django.contrib.auth import get_user_model, authenticate
 
 User = get_user_model()
 
+def with_ride_relations(queryset, request, event_model):
+    """
+    Adds the select_related and today's events Prefetch that RideSerializer
+    needs, limited to the relations the request will render (see
+    RideSerializer.requested_relations).
+    """
+    relations = RideSerializer.requested_relations(request)
+
+    # Base queryset with select_related for foreign keys
+    # This creates a single query with JOINs for rider and driver
+    joined = [name for name in ('rider', 'driver') if name in relations]
+    if joined:
+        queryset = queryset.select_related(*joined)
+
+    # Prefetch today's ride events (last 24 hours)
+    # This creates a separate query for events but is more efficient than
+    # fetching all events or making a query per ride
+    if 'todays_ride_events' in relations:
+        today = datetime.now()
+        yesterday = today - timedelta(days=1)
+        todays_events = Prefetch(
+            'events',  # The related name for RideEvent
+            queryset=event_model.objects.filter(created_at__gte=yesterday),
+            to_attr='todays_ride_events'  # Store results in this attribute
+        )
+        queryset = queryset.prefetch_related(todays_events)
+    return queryset
+
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class DriverRideCursorPagination(CursorPagination):
+    """
+    Keyset pagination for a driver's ride history, newest first.
+    Each page is a range scan on the (driver, pickup_time) indexes however
+    deep the client pages, and the total comes from the precomputed
+    DriverRideCount rows instead of a COUNT(*).
+    """
+    ordering = '-pickup_time'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+class ChangeFeedPagination(BasePagination):
+    """
+    Cursor pagination over the change log sequence number.
+    Returns up to `limit` (1 to max_limit) changes with seq greater than
+    `since`, and the cursor to pass as `since` on the next call.
+    """
+    default_limit = 100
+    max_limit = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            self.limit = int(request.query_params.get('limit', self.default_limit))
+            since = request.query_params.get('since')
+            self.since = int(since) if since is not None else None
+        except ValueError:
+            raise ValidationError({'detail': 'since and limit must be integers.'})
+        if not 1 <= self.limit <= self.max_limit:
+            raise ValidationError({'limit': [f'Must be between 1 and {self.max_limit}.']})
+
+        if self.since is None:
+            # No cursor yet: return none of the history, only where it ends,
+            # so a client can sync from here after its initial full load
+            self.next = queryset.order_by('-seq').values_list('seq', flat=True).first() or 0
+            self.has_more = False
+            return []
+
+        entries = list(queryset.filter(seq__gt=self.since).order_by('seq')[:self.limit + 1])
+        self.has_more = len(entries) > self.limit
+        entries = entries[:self.limit]
+        self.next = entries[-1].seq if entries else self.since
+        return entries
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next,
+            'has_more': self.has_more,
+            'results': data,
+        })
+
 class IsAdminOrDriverUser(permissions.BasePermission):
     """
     Custom permission to allow admin and driver users to access the API.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.role in ['admin', 'driver']
+        return bool(request.user and request.user.is_authenticated and request.user.role in ['admin', 'driver'])
 
 class IsAdminUser(permissions.BasePermission):
     """
     Custom permission to only allow admin users to access user management.
     """
     def has_permission(self, request, view):
-        if view.action == 'me':
-            return bool(request.user and request.user.is_authenticated)
-        return request.user and request.user.role == 'admin'
+        if not (request.user and request.user.is_authenticated):
+            return False
+        if view.action in ('me', 'rides'):
+            return True
+        return request.user.role == 'admin'
 
-class RideEventViewSet(viewsets.ModelViewSet):
+class RideEventViewSet(ProfilingMixin, viewsets.ModelViewSet):
     """
     ViewSet for RideEvent model.
     Handles CRUD operations for ride events.
@@ -49,21 +156,130 @@ class RideEventViewSet(viewsets.ModelViewSet):
         ride_id = self.kwargs.get('ride_pk')
         serializer.save(ride_id=ride_id)
 
-class RideViewSet(viewsets.ModelViewSet):
+class RideViewSet(ProfilingMixin, viewsets.ModelViewSet):
     """
     ViewSet for Ride model with optimized queries and filtering.
     Implements all required functionality including:
-    - Pagination
-    - Filtering by status and rider email
+    - Pagination (?page_size= up to 100)
+    - Filtering by status, rider email, pickup time range and map viewport (bbox)
     - Sorting by pickup_time and distance to pickup
     - Efficient retrieval of today's ride events
+
+    Completed and cancelled rides older than the retention window live in
+    the archive tables. They are read (never written) from there when the
+    request passes ?archived=true, or when it filters on an archived status
+    and pickup_time_before falls before the archive watermark (the cutoff of
+    the last complete archive_rides run), so no matching ride can still be
+    in the hot table. ?archived=false always forces the hot table.
     """
-    serializer_class = RideSerializer
     permission_classes = [IsAdminOrDriverUser]
+    pagination_class = StandardResultsSetPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['status', 'rider__email']
     ordering_fields = ['pickup_time', 'distance_to_pickup']
     ordering = ['-pickup_time']  # Default ordering
+    MAX_CLUSTER_ZOOM = 20
+    CLUSTER_CELLS_PER_TILE = 4
+    # Most grid cells a clusters request may span, which bounds its output
+    MAX_CLUSTER_CELLS = 10000
+
+    def uses_archive(self):
+        """
+        Decides whether this request is served from the archive tables.
+        """
+        if not hasattr(self, '_uses_archive'):
+            self._uses_archive = self._select_archive()
+        return self._uses_archive
+
+    def _select_archive(self):
+        params = self.request.query_params
+        archived = params.get('archived')
+        if archived is not None:
+            return archived.lower() in ('true', '1')
+
+        # Rides in any other status stay in the hot table however old they are
+        if params.get('status') not in ARCHIVED_STATUSES:
+            return False
+        try:
+            before = parse_datetime(params.get('pickup_time_before', ''))
+        except ValueError:
+            # Well formatted but not a real date; the filterset reports it as a 400
+            return False
+        if before is None:
+            return False
+        if timezone.is_naive(before):
+            before = timezone.make_aware(before)
+        watermark = archive_watermark()
+        return watermark is not None and before <= watermark
+
+    @property
+    def filterset_class(self):
+        return ArchivedRideFilter if self.uses_archive() else RideFilter
+
+    def get_serializer_class(self):
+        return ArchivedRideSerializer if self.uses_archive() else RideSerializer
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.uses_archive() and request.method not in permissions.SAFE_METHODS:
+            raise MethodNotAllowed(request.method, detail='Archived rides are read-only.')
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        """
+        Aggregated pickup markers for a map view.
+        Groups pickups into a grid whose cells shrink as ?zoom= (0-20) grows
+        and returns the count and centroid of each non-empty cell. Accepts the
+        same filters as the list, typically ?bbox= for the visible viewport.
+        The viewport (the whole world without ?bbox=) may span at most
+        MAX_CLUSTER_CELLS cells, so higher zooms need a bbox.
+        """
+        try:
+            zoom = int(request.query_params.get('zoom', 0))
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= self.MAX_CLUSTER_ZOOM:
+            return Response(
+                {'zoom': [f'Must be an integer between 0 and {self.MAX_CLUSTER_ZOOM}.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # A map tile spans 360 / 2**zoom degrees; each tile is split into a few cells
+        cell_size = 360 / 2 ** zoom / self.CLUSTER_CELLS_PER_TILE
+        model = ArchivedRide if self.uses_archive() else Ride
+        filterset = self.filterset_class(request.query_params, queryset=model.objects.all(), request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+
+        min_lon, min_lat, max_lon, max_lat = filterset.form.cleaned_data.get('bbox') or (-180, -90, 180, 90)
+        lon_span = max_lon - min_lon if min_lon <= max_lon else 360 - (min_lon - max_lon)
+        # +1 per axis for the partial cells at the viewport's edges
+        cell_count = (math.ceil(lon_span / cell_size) + 1) * (math.ceil((max_lat - min_lat) / cell_size) + 1)
+        if cell_count > self.MAX_CLUSTER_CELLS:
+            return Response(
+                {'detail': f'The viewport spans {cell_count} cells at zoom {zoom}, more than '
+                           f'{self.MAX_CLUSTER_CELLS}. Pass a smaller ?bbox= or a lower zoom.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        cells = (
+            filterset.qs
+            .annotate(
+                cell_x=Floor(F('pickup_longitude') / cell_size),
+                cell_y=Floor(F('pickup_latitude') / cell_size),
+            )
+            .values('cell_x', 'cell_y')
+            .annotate(
+                count=Count('pk'),
+                latitude=Avg('pickup_latitude'),
+                longitude=Avg('pickup_longitude'),
+            )
+            .order_by()
+        )
+        clusters = [
+            {'latitude': cell['latitude'], 'longitude': cell['longitude'], 'count': cell['count']}
+            for cell in cells
+        ]
+        return Response({'zoom': zoom, 'cell_size': cell_size, 'clusters': clusters})
 
     @action(detail=True, methods=['get', 'post'])
     def events(self, request, pk=None):
@@ -72,7 +288,7 @@ class RideViewSet(viewsets.ModelViewSet):
         """
         ride = self.get_object()
         if request.method == 'GET':
-            events = RideEvent.objects.filter(ride=ride)
+            events = ride.events.all()
             serializer = RideEventSerializer(events, many=True)
             return Response(serializer.data)
         elif request.method == 'POST':
@@ -105,22 +321,17 @@ class RideViewSet(viewsets.ModelViewSet):
         - 1 query for today's events (prefetch_related)
         - 1 query for count (pagination)
         Total: 3 queries regardless of number of rides
-        """
-        # Base queryset with select_related for foreign keys
-        # This creates a single query with JOINs for rider and driver
-        queryset = Ride.objects.select_related('rider', 'driver')
 
-        # Prefetch today's ride events (last 24 hours)
-        # This creates a separate query for events but is more efficient than
-        # fetching all events or making a query per ride
-        today = datetime.now()
-        yesterday = today - timedelta(days=1)
-        todays_events = Prefetch(
-            'events',  # The related name for RideEvent
-            queryset=RideEvent.objects.filter(created_at__gte=yesterday),
-            to_attr='todays_ride_events'  # Store results in this attribute
-        )
-        queryset = queryset.prefetch_related(todays_events)
+        Relations excluded with ?fields= or ?expand= are not joined or
+        prefetched, so a request for only id, status and pickup_time runs
+        a single rides query plus the count.
+
+        Archived rides are queried the same way from the archive tables.
+        """
+        if self.uses_archive():
+            queryset = with_ride_relations(ArchivedRide.objects.all(), self.request, ArchivedRideEvent)
+        else:
+            queryset = with_ride_relations(Ride.objects.all(), self.request, RideEvent)
 
         # Handle distance-based sorting if requested
         ordering = self.request.query_params.get('ordering', '')
@@ -155,12 +366,12 @@ class RideViewSet(viewsets.ModelViewSet):
         context['request'] = self.request
         return context
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ProfilingMixin, viewsets.ModelViewSet):
     """
     ViewSet for User model with CRUD operations.
     Only admin users can manage other users.
     """
-    queryset = User.objects.all()
+    queryset = User.objects.order_by('id')
     serializer_class = UserSerializer
     permission_classes = [IsAdminUser]
     pagination_class = StandardResultsSetPagination
@@ -176,6 +387,73 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(request.user)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def rides(self, request, pk=None):
+        """
+        A driver's rides, newest first, optionally filtered with ?status=.
+        Use "me" as the id for the current user. Drivers can only read their
+        own history; admins can read anyone's. Supports ?fields= and ?expand=
+        like the rides list.
+
+        The history and its precomputed count cover the hot Ride table only.
+        Completed and cancelled rides moved out by archive_rides (older than
+        RIDE_ARCHIVE_RETENTION_DAYS) are listed with ?archived=true instead,
+        where the count is a plain COUNT(*) on the archive.
+        """
+        driver_id = request.user.pk if pk == 'me' else pk
+        try:
+            driver_id = int(driver_id)
+        except (TypeError, ValueError):
+            raise Http404
+        if request.user.role != 'admin' and driver_id != request.user.pk:
+            raise PermissionDenied('You can only view your own rides.')
+
+        archived = request.query_params.get('archived', '').lower() in ('true', '1')
+        ride_status = request.query_params.get('status')
+        queryset = (ArchivedRide if archived else Ride).objects.filter(driver_id=driver_id)
+        counts = DriverRideCount.objects.filter(driver_id=driver_id)
+        if ride_status:
+            if ride_status not in dict(Ride.STATUS_CHOICES):
+                return Response({'status': [f'"{ride_status}" is not a valid choice.']},
+                                status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(status=ride_status)
+            counts = counts.filter(status=ride_status)
+
+        paginator = DriverRideCursorPagination()
+        event_model = ArchivedRideEvent if archived else RideEvent
+        page = paginator.paginate_queryset(with_ride_relations(queryset, request, event_model), request, view=self)
+        if archived:
+            paginator.count = queryset.count()
+        else:
+            paginator.count = counts.aggregate(total=Sum('count'))['total'] or 0
+        serializer_class = ArchivedRideSerializer if archived else RideSerializer
+        serializer = serializer_class(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='bulk-import')
+    def bulk_import(self, request):
+        """
+        Create many users in one request.
+        Accepts a list of user objects (or {"users": [...]}) with the same
+        fields as the create endpoint. Nothing is written if any row is invalid.
+        At most BULK_IMPORT_MAX_ROWS users are accepted per request.
+        """
+        rows = request.data.get('users') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            return Response({'detail': 'Expected a list of user objects.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_rows = settings.BULK_IMPORT_MAX_ROWS
+        if len(rows) > max_rows:
+            return Response(
+                {'detail': f'A bulk import can contain at most {max_rows} users.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            created = bulk_import_users(rows)
+        except BulkImportError as e:
+            return Response({'errors': e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': created}, status=status.HTTP_201_CREATED)
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -195,3 +473,64 @@ class UserViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+class ChangeFeedViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Incremental change feed of ride and ride event creates, updates and deletes.
+    Clients keep the returned `next` cursor and call ?since=<next> to fetch only
+    what changed, so the work per sync depends on activity, not dataset size.
+    """
+    queryset = ChangeLogEntry.objects.all()
+    serializer_class = ChangeLogEntrySerializer
+    permission_classes = [IsAdminOrDriverUser]
+    pagination_class = ChangeFeedPagination
+    filter_backends = []
+
+class BatchView(APIView):
+    """
+    Runs several API requests in one round trip.
+    Accepts {"requests": [{"method": "GET", "path": "/api/users/me/", "body": {...}}, ...]}
+    and returns {"results": [{"status": 200, "body": {...}}, ...]} in the same order.
+    Sub-requests reuse this request's authentication; independent reads run concurrently.
+    """
+    def post(self, request):
+        specs = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(specs, list):
+            return Response({'detail': 'Expected a "requests" list.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_requests = settings.BATCH_REQUESTS['MAX_REQUESTS']
+        if len(specs) > max_requests:
+            return Response(
+                {'detail': f'A batch can contain at most {max_requests} requests.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({'results': run_batch(request, specs, type(self))})
+
+class ProfileViewSet(viewsets.ViewSet):
+    """
+    Lists and downloads request profiles captured by ProfilingMixin.
+    Only admin users can access captured profiles.
+    """
+    permission_classes = [IsAdminUser]
+    lookup_value_regex = REQUEST_ID_RE.pattern.strip('^$')
+
+    def list(self, request):
+        return Response(list_profiles())
+
+    def retrieve(self, request, pk=None):
+        """
+        Get a profile's metadata, SQL trace and most expensive functions
+        """
+        data = load_profile(pk)
+        if data is None:
+            raise Http404
+        return Response(data)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Download the raw cProfile output, readable with pstats or snakeviz
+        """
+        path = profile_path(pk, '.prof')
+        if not path.exists():
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)